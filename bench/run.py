@@ -0,0 +1,281 @@
+"""
+Load test of the dispatcher and the database.
+
+Seeds a database of the given size, feeds synthetic updates through the
+dispatcher, middlewares and routers of main.create_dispatcher with a fake Bot
+session, and reports throughput and latency per handler and per Database
+method as JSON.
+
+    python -m bench.run --users 1000000 --clicks 20000000 --starts 20000 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+
+# Handlers read the config on import, make the bench user an admin
+BENCH_ADMIN_ID = 1
+os.environ["ADMIN_IDS"] = str(BENCH_ADMIN_ID)
+os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update, Message, Chat, User, PhotoSize
+from loguru import logger
+
+from db.async_database import AsyncDatabase
+from db.database import Database
+from db.migrations import MIGRATIONS, apply_migrations
+from main import create_dispatcher
+from utils.broadcast import Broadcaster
+from utils.charts import ChartRenderer
+from utils.tenants import BotConfig, Tenant
+
+ADMIN_COMMANDS = ["/stats_users", "/stats_buttons", "/stats_chart", "/stats_daily", "/stats_active"]
+
+
+class FakeSession(BaseSession):
+    """
+    Bot session that answers every request locally after an optional delay
+    """
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.requests = 0
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout=None):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__returning__ is Message:
+            return Message(
+                message_id=self.requests,
+                date=datetime.now(),
+                chat=Chat(id=getattr(method, "chat_id", 0) or 0, type="private"),
+                photo=[PhotoSize(file_id="bench", file_unique_id="bench", width=1, height=1)],
+            )
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def seed_database(path, users, clicks, days=90):
+    """
+    Create a database with `users` users and `clicks` clicks spread over `days` days.
+    Raw rows are generated in SQL, aggregates are built by the migrations' backfills.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    # Base schema only, the remaining migrations backfill from the seeded rows
+    apply_migrations(connection, MIGRATIONS[:2])
+    connection.execute(
+        """
+        WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < ?)
+        INSERT INTO users (user_id, username, first_name, last_name, registration_date)
+        SELECT x, 'user' || x, 'First', 'Last',
+               datetime('now', 'localtime', '-' || (abs(random()) % (? * 86400)) || ' seconds')
+        FROM seq
+        """,
+        (users, days)
+    )
+    connection.execute(
+        """
+        WITH RECURSIVE seq(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM seq WHERE x < ?)
+        INSERT INTO button_clicks (user_id, button_name, click_time)
+        SELECT abs(random()) % ? + 1, 'start',
+               datetime('now', 'localtime', '-' || (abs(random()) % (? * 86400)) || ' seconds')
+        FROM seq
+        """,
+        (clicks, users, days)
+    )
+    connection.commit()
+    apply_migrations(connection)
+    connection.close()
+
+
+class TimedAsyncDatabase(AsyncDatabase):
+    """
+    AsyncDatabase that records how long every executor call takes
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timings = defaultdict(list)
+
+    async def _run(self, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super()._run(func, *args, **kwargs)
+        finally:
+            self.timings[func.__name__].append(time.perf_counter() - start)
+
+
+def make_update(update_id, user_id, text):
+    user = User(id=user_id, is_bot=False, first_name="Bench", username=f"bench{user_id}")
+    return Update(
+        update_id=update_id,
+        message=Message(
+            message_id=update_id,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type="private"),
+            from_user=user,
+            text=text,
+        ),
+    )
+
+
+def summarize(samples, wall_time=None):
+    """Count, throughput and latency percentiles in milliseconds"""
+    samples = sorted(samples)
+    count = len(samples)
+
+    def percentile(p):
+        return round(samples[min(count - 1, int(count * p))] * 1000, 3)
+
+    result = {
+        "count": count,
+        "p50_ms": percentile(0.50),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+    if wall_time:
+        result["per_second"] = round(count / wall_time, 1)
+    return result
+
+
+async def feed_all(dp, bot, updates, concurrency):
+    """
+    Feed labelled updates with at most `concurrency` in flight
+    :return: latencies per label and the wall time
+    """
+    latencies = defaultdict(list)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def feed(label, update):
+        async with semaphore:
+            start = time.perf_counter()
+            await dp.feed_update(bot, update)
+            latencies[label].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(feed(label, update) for label, update in updates))
+    return latencies, time.perf_counter() - start
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    if args.seed or not os.path.exists(args.db):
+        print(f"Seeding {args.db}: {args.users} users, {args.clicks} clicks", file=sys.stderr)
+        start = time.perf_counter()
+        seed_database(args.db, args.users, args.clicks)
+        print(f"Seeded in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    db = TimedAsyncDatabase(Database(args.db))
+    session = FakeSession(latency=args.api_latency / 1000)
+    bot = Bot("42:BENCH", session=session)
+    config = BotConfig("bench", bot.token, frozenset({str(BENCH_ADMIN_ID)}), args.db)
+    tenant = Tenant(config, bot, db, Broadcaster(db))
+    tenant.start()
+    # The same dispatcher and middlewares as the bot runs with
+    charts = ChartRenderer()
+    dp = await create_dispatcher([tenant], charts)
+    # The first chart waits seconds for the process to start and import matplotlib
+    await charts.render("bar", "warm-up", ["warm-up"], [1])
+
+    rng = random.Random(args.random_seed)
+    update_id = 0
+    results = {"phases": {}}
+    handlers = defaultdict(list)
+
+    # /start burst: returning users and brand new ones
+    updates = []
+    for _ in range(args.starts):
+        update_id += 1
+        if rng.random() < args.new_user_ratio:
+            user_id = args.users + update_id
+        else:
+            user_id = rng.randint(2, args.users)
+        updates.append(("/start", make_update(update_id, user_id, "/start")))
+    latencies, wall_time = await feed_all(dp, bot, updates, args.concurrency)
+    for label, samples in latencies.items():
+        handlers[label].extend(samples)
+    results["phases"]["start_burst"] = summarize(latencies["/start"], wall_time)
+
+    # Write out the buffered inserts and measure how long that takes
+    start = time.perf_counter()
+    await db.buffer.flush()
+    results["phases"]["flush"] = {"seconds": round(time.perf_counter() - start, 3)}
+
+    # Admin stats commands
+    updates = []
+    for i in range(args.admin_commands):
+        update_id += 1
+        command = ADMIN_COMMANDS[i % len(ADMIN_COMMANDS)]
+        updates.append((command, make_update(update_id, BENCH_ADMIN_ID, command)))
+    latencies, wall_time = await feed_all(dp, bot, updates, args.concurrency)
+    for label, samples in latencies.items():
+        handlers[label].extend(samples)
+    results["phases"]["admin_commands"] = summarize(
+        [sample for samples in latencies.values() for sample in samples], wall_time
+    )
+
+    results["handlers"] = {label: summarize(samples) for label, samples in sorted(handlers.items())}
+    results["db_methods"] = {name: summarize(samples) for name, samples in sorted(db.timings.items())}
+    results["bot_requests"] = session.requests
+
+    await charts.close()
+    await tenant.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="data/bench.sqlite", help="database file, seeded if it doesn't exist")
+    parser.add_argument("--seed", action="store_true", help="re-create the database even if it exists")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--clicks", type=int, default=100000)
+    parser.add_argument("--starts", type=int, default=5000, help="number of /start updates")
+    parser.add_argument("--new-user-ratio", type=float, default=0.2, help="share of /start from unknown users")
+    parser.add_argument("--admin-commands", type=int, default=50, help="number of admin stats commands")
+    parser.add_argument("--concurrency", type=int, default=100, help="updates processed at the same time")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="simulated Bot API latency, ms")
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    results = asyncio.run(run(args))
+    results["commit"] = git_commit()
+    results["created_at"] = datetime.now().isoformat(timespec="seconds")
+    results["params"] = {k: v for k, v in vars(args).items() if k not in ("output", "seed")}
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
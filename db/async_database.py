@@ -0,0 +1,192 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from loguru import logger
+
+from db.database import Database
+from db.query_cache import QueryCache
+from db.write_buffer import WriteBehindBuffer
+from utils.metrics import metrics, DB_SECONDS
+
+
+# Cached stats methods: name -> (TTL in seconds, tables they read).
+# Write methods below invalidate the entries that read their tables. Inserts
+# group-committed by the write-behind buffer don't: under traffic they land
+# every flush interval and no entry would ever be reused. So admin stats may
+# lag behind new users and clicks by up to the TTL, same as for writes made
+# by another process.
+CACHED_QUERIES = {
+    "get_user_count": (10, ("counters",)),
+    "get_button_stats": (30, ("button_totals",)),
+    "get_daily_stats": (60, ("click_rollups",)),
+    "get_click_series": (60, ("click_rollups",)),
+    "get_hourly_stats": (30, ("click_rollups",)),
+    "get_most_active_users": (60, ("user_totals", "users")),
+    "get_active_users_count": (60, ("daily_user_sketches", "button_clicks", "click_archive")),
+    "get_retention_matrix": (300, ("users", "button_clicks", "click_archive")),
+}
+
+# Analytics queries run on the pool of read-only connections, everything else on
+# the single writer connection, so admin reports never delay user updates
+READ_POOL_METHODS = {*CACHED_QUERIES, "get_user_stats", "get_export_chunk"}
+
+# Write methods: name -> tables they change
+INVALIDATING_METHODS = {
+    "archive_clicks": ("button_clicks", "click_archive", "counters"),
+}
+
+
+class AsyncDatabase:
+    """
+    Async facade over Database.
+    Every query runs on a dedicated thread, so handlers can await it
+    while polling and outgoing requests keep going on the event loop.
+    Writes and short lookups share one writer thread and connection,
+    analytics queries run on a bounded pool of read-only connections.
+    """
+    def __init__(self, db: Database, readers=4, batch_size=500, flush_interval=0.5,
+                 settings_refresh_interval=5, cache_size=256, checkpoint_interval=30):
+        self.db = db
+        self.settings_refresh_interval = settings_refresh_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.wal_frames = 0
+        self._refresh_task = None
+        self._checkpoint_task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader", initializer=db.open_reader)
+        metrics.gauge("bot_db_wal_frames", lambda: self.wal_frames, "Frames in the WAL file after the last checkpoint")
+        # User and click inserts are group-committed by the write-behind buffer
+        self.buffer = WriteBehindBuffer(self._write_batch, max_size=batch_size, flush_interval=flush_interval)
+        metrics.gauge("bot_write_buffer_pending", lambda: len(self.buffer), "Inserts waiting for the write-behind flush")
+        metrics.counter(
+            "bot_write_buffer_dropped_total", lambda: self.buffer.dropped,
+            "Buffered inserts dropped because they kept failing"
+        )
+        self.cache = QueryCache(max_size=cache_size)
+        metrics.counter("bot_query_cache_hits_total", lambda: self.cache.hits, "Stats queries served from the cache")
+        metrics.counter("bot_query_cache_misses_total", lambda: self.cache.misses, "Stats queries run on the database")
+        metrics.counter(
+            "bot_query_cache_coalesced_total", lambda: self.cache.coalesced,
+            "Stats queries that waited for an identical query in flight"
+        )
+
+    async def _write_batch(self, users, clicks):
+        # Doesn't invalidate the query cache, see CACHED_QUERIES
+        await self._run(self.db.write_batch, users, clicks)
+
+    def start(self):
+        """Start background tasks, must be called from a running loop"""
+        self.buffer.start()
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_settings_loop())
+        if self._checkpoint_task is None and self.checkpoint_interval:
+            self._checkpoint_task = asyncio.create_task(self._checkpoint_loop())
+
+    async def _refresh_settings_loop(self):
+        # Picks up settings changed by another process
+        while True:
+            await asyncio.sleep(self.settings_refresh_interval)
+            try:
+                if await self._run(self.db.refresh_settings):
+                    logger.info(f"Settings reloaded, version {self.settings_version}")
+            except Exception:
+                logger.exception("Failed to refresh settings")
+
+    async def _checkpoint_loop(self):
+        # Without it the WAL is only checkpointed by the commit that happens to
+        # fill it, which then waits for the whole copy. Runs on the default
+        # executor, so writes and reads don't queue behind it
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                busy, self.wal_frames, copied = await asyncio.to_thread(self.db.checkpoint)
+                if busy:
+                    logger.debug("WAL checkpoint didn't finish, {} of {} frames copied", copied, self.wal_frames)
+            except Exception:
+                logger.exception("WAL checkpoint failed")
+
+    @property
+    def settings_version(self):
+        """Version of the cached settings"""
+        return self.db.settings_version
+
+    # Settings are cached in memory, so these never touch the executor
+    async def get_welcome_message(self):
+        """Get welcome message text"""
+        return self.db.get_welcome_message()
+
+    async def get_welcome_link(self):
+        """Get welcome link"""
+        return self.db.get_welcome_link()
+
+    async def get_welcome_link_text(self):
+        """Get welcome link button text"""
+        return self.db.get_welcome_link_text()
+
+    async def add_user(self, user_id, username=None, first_name=None, last_name=None):
+        """Queue a user insert"""
+        await self.buffer.add_user(user_id, username, first_name, last_name)
+
+    async def record_button_click(self, user_id, button_name):
+        """Queue a button click"""
+        await self.buffer.add_click(user_id, button_name)
+
+    async def drain(self):
+        """Write all queued inserts to the database"""
+        await self.buffer.close()
+
+    async def _run(self, func, *args, **kwargs):
+        """Run a blocking Database call on the writer thread, or on the read pool for analytics"""
+        loop = asyncio.get_running_loop()
+        executor = self._readers if func.__name__ in READ_POOL_METHODS else self._executor
+        return await loop.run_in_executor(executor, partial(self._timed, func, *args, **kwargs))
+
+    @staticmethod
+    def _timed(func, *args, **kwargs):
+        # Measured inside the worker thread, so queueing time is not included
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.observe(DB_SECONDS, "method", func.__name__, time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        # Wrap every public Database method into a coroutine function
+        attr = getattr(self.db, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        if name in CACHED_QUERIES:
+            ttl, tables = CACHED_QUERIES[name]
+
+            async def method(*args, **kwargs):
+                key = (name, args, tuple(sorted(kwargs.items())))
+                return await self.cache.get(key, ttl, partial(self._run, attr, *args, **kwargs), tables)
+        elif name in INVALIDATING_METHODS:
+            async def method(*args, **kwargs):
+                try:
+                    return await self._run(attr, *args, **kwargs)
+                finally:
+                    self.cache.invalidate(*INVALIDATING_METHODS[name])
+        else:
+            async def method(*args, **kwargs):
+                return await self._run(attr, *args, **kwargs)
+
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        return method
+
+    async def close(self):
+        """Drain queued inserts, wait for pending queries, then close all connections"""
+        for task in (self._refresh_task, self._checkpoint_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._refresh_task = self._checkpoint_task = None
+        await self.drain()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+        await loop.run_in_executor(None, self._readers.shutdown)
+        self.db.close()
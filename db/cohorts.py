@@ -0,0 +1,190 @@
+import threading
+from array import array
+from bisect import bisect_left
+from datetime import date, timedelta
+
+# Weeks are counted from this Monday, so week numbers start on Mondays
+EPOCH = date(2000, 1, 3)
+# Retention is tracked for this many weeks after registration, one bit per week
+MAX_WEEKS = 64
+# Users registered a bit before the newest known one are re-read on update, in case
+# another process committed them late. Write-behind batches are committed within seconds
+REGISTRATION_SLACK = timedelta(minutes=5)
+
+
+def week_sql(column):
+    """SQL expression of the week number of a timestamp column"""
+    return f"CAST((julianday({column}) - julianday('{EPOCH}')) / 7 AS INTEGER)"
+
+
+def week_of(day):
+    """Week number of a date"""
+    return (day - EPOCH).days // 7
+
+
+def week_start(week):
+    """Monday of a week number"""
+    return EPOCH + timedelta(weeks=week)
+
+
+class CohortEngine:
+    """
+    Weekly registration cohorts x weeks since registration, counting distinct active users.
+
+    Users are kept in three parallel arrays sorted by user_id: the cohort (week
+    of registration) and a bit mask of the weeks after registration in which
+    the user clicked anything. A click sets its bit and, if it wasn't set yet,
+    adds one to its cell of the matrix, so counting doesn't depend on the order
+    of clicks and reading a click twice changes nothing.
+
+    Every update reads only users and clicks added since the previous one.
+    The archive is read only after Database.archive_clicks moved clicks into it,
+    which it counts in counters.archived_clicks, and only from the last archived
+    day seen: clicks are archived oldest first. Archived days before the last
+    MAX_WEEKS weeks are never read, they can't change a cohort that matrix() shows.
+    """
+    def __init__(self):
+        self._user_ids = array("q")
+        self._cohorts = array("l")
+        self._masks = array("Q")
+        # cohort -> number of users, cohort -> active users per week since registration
+        self.sizes = {}
+        self.counts = {}
+        self.last_click_id = 0
+        # Value of the archived_clicks counter at the last update, None before the first one
+        self._archived = None
+        # Last day read from click_archive, that day is read again as it may have been archived in part
+        self._archive_day = None
+        self._last_registration = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    def update(self, connection, today=None):
+        """
+        Read users and clicks added since the previous update
+        :param connection: sqlite3 connection, both reads use one snapshot
+        :return: number of clicks read
+        """
+        with self._lock:
+            connection.execute("BEGIN")
+            try:
+                self._load_users(connection)
+                clicks = 0
+                archived = connection.execute("SELECT value FROM counters WHERE name = 'archived_clicks'").fetchone()
+                archived = archived[0] if archived else 0
+                if archived != self._archived:
+                    # Clicks were moved to the archive since the last update, some of them
+                    # may not have been read yet. Reading the others again changes nothing
+                    first_day = self._archive_day or week_start(week_of(today or date.today()) - MAX_WEEKS + 1).isoformat()
+                    last_day = connection.execute("SELECT MAX(day) FROM click_archive").fetchone()[0]
+                    if last_day is not None and last_day >= first_day:
+                        clicks += self._add_clicks(connection.execute(
+                            f"SELECT user_id, {week_sql('day')} FROM click_archive WHERE day >= ? AND day <= ?",
+                            (first_day, last_day)
+                        ))
+                        self._archive_day = last_day
+                    self._archived = archived
+                last_id = connection.execute("SELECT MAX(id) FROM button_clicks").fetchone()[0]
+                if last_id is not None and last_id > self.last_click_id:
+                    clicks += self._add_clicks(connection.execute(
+                        f"SELECT user_id, {week_sql('click_time')} FROM button_clicks WHERE id > ? AND id <= ?",
+                        (self.last_click_id, last_id)
+                    ))
+                    self.last_click_id = last_id
+            finally:
+                connection.execute("COMMIT")
+            return clicks
+
+    def _load_users(self, connection):
+        query = f"SELECT user_id, {week_sql('registration_date')}, registration_date FROM users WHERE registration_date IS NOT NULL"
+        params = ()
+        if self._last_registration is not None:
+            query += " AND registration_date >= datetime(?, ?)"
+            params = (self._last_registration, f"-{REGISTRATION_SLACK.total_seconds()} seconds")
+
+        user_ids = self._user_ids
+        size = len(user_ids)
+        new_users = []
+        for user_id, cohort, registration_date in connection.execute(query, params):
+            index = bisect_left(user_ids, user_id)
+            if index < size and user_ids[index] == user_id:
+                continue
+            new_users.append((index, user_id, cohort))
+            # Timestamps are ISO strings, they compare in time order
+            self._last_registration = max(self._last_registration or registration_date, registration_date)
+        if not new_users:
+            return
+
+        # Sorting in SQL would make it scan the whole table by user_id instead of the index
+        new_users.sort()
+        for _, _, cohort in new_users:
+            self.sizes[cohort] = self.sizes.get(cohort, 0) + 1
+            if cohort not in self.counts:
+                self.counts[cohort] = array("l", [0]) * MAX_WEEKS
+        self._user_ids, self._cohorts, self._masks = self._merge(new_users)
+
+    def _merge(self, new_users):
+        """
+        Copy the arrays with new users inserted, in one pass over them
+        :param new_users: (index in the current arrays, user_id, cohort), sorted by user_id
+        """
+        user_ids, cohorts, masks = array("q"), array("l"), array("Q")
+        start = 0
+        for index, user_id, cohort in new_users:
+            if index > start:
+                user_ids.extend(self._user_ids[start:index])
+                cohorts.extend(self._cohorts[start:index])
+                masks.extend(self._masks[start:index])
+                start = index
+            user_ids.append(user_id)
+            cohorts.append(cohort)
+            masks.append(0)
+        user_ids.extend(self._user_ids[start:])
+        cohorts.extend(self._cohorts[start:])
+        masks.extend(self._masks[start:])
+        return user_ids, cohorts, masks
+
+    def _add_clicks(self, rows):
+        """Set the week bits of (user_id, week) rows"""
+        user_ids, cohorts, masks, counts = self._user_ids, self._cohorts, self._masks, self.counts
+        size = len(user_ids)
+        read = 0
+        for user_id, week in rows:
+            read += 1
+            index = bisect_left(user_ids, user_id)
+            if index == size or user_ids[index] != user_id:
+                continue
+            cohort = cohorts[index]
+            offset = week - cohort
+            if offset < 0 or offset >= MAX_WEEKS:
+                continue
+            bit = 1 << offset
+            mask = masks[index]
+            if not mask & bit:
+                masks[index] = mask | bit
+                counts[cohort][offset] += 1
+        return read
+
+    def matrix(self, cohorts, today=None):
+        """
+        Retention of the latest cohorts
+        :param cohorts: number of weekly cohorts, the current week is the last one
+        :return: list of (first day of the cohort, users, [active users in week 0, 1, ...]),
+                 oldest cohort first, weeks that haven't started yet are left out
+        """
+        current = week_of(today or date.today())
+        # Older cohorts would miss archived clicks that update() skips
+        cohorts = min(cohorts, MAX_WEEKS)
+        with self._lock:
+            result = []
+            for cohort in range(current - cohorts + 1, current + 1):
+                weeks = min(current - cohort + 1, cohorts, MAX_WEEKS)
+                counts = self.counts.get(cohort)
+                result.append((
+                    week_start(cohort),
+                    self.sizes.get(cohort, 0),
+                    list(counts[:weeks]) if counts is not None else [0] * weeks,
+                ))
+            return result
@@ -1,174 +1,558 @@
 import sqlite3
 import os
+import threading
+from collections import Counter
 from datetime import datetime, timedelta
 
+from db.cohorts import CohortEngine
+from db.hll import HyperLogLog
+from db.migrations import apply_migrations, get_schema_version
+from db.settings_cache import SettingsCache
+
+# Format of click_rollups.bucket, one bucket per hour
+BUCKET_FORMAT = "%Y-%m-%d %H:00"
+
+# Tables available for export: name -> (table, number of leading key columns, columns)
+EXPORT_TABLES = {
+    "users": ("users", 1, ("user_id", "username", "first_name", "last_name", "registration_date")),
+    "clicks": ("button_clicks", 1, ("id", "user_id", "button_name", "click_time")),
+    "archive": ("click_archive", 3, ("user_id", "button_name", "day", "clicks")),
+}
+
+# Modes of PRAGMA wal_checkpoint
+CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+
 class Database:
-    def __init__(self, db_file='data/db.sqlite'):
+    def __init__(self, db_file='data/db.sqlite', cache_size_mb=32, mmap_size_mb=256):
+        """
+        :param cache_size_mb: page cache of each connection
+        :param mmap_size_mb: part of the file read through memory mapping, shared by all connections
+        """
         # Ensure directory exists
         os.makedirs(os.path.dirname(db_file), exist_ok=True)
-        self.connection = sqlite3.connect(db_file)
-        self.cursor = self.connection.cursor()
+        self.db_file = db_file
+        self.cache_size_mb = cache_size_mb
+        self.mmap_size_mb = mmap_size_mb
+        # Each thread gets its own connection, so the executor in
+        # db.async_database can run queries in parallel
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        # Settings are served from memory; the watch connection is only used
+        # to notice commits made by other connections or processes
+        self.settings = SettingsCache()
+        self._watch_connection = None
+        self._watch_lock = threading.Lock()
+        self._watch_data_version = None
+        self._checkpoint_connection = None
+        self._checkpoint_lock = threading.Lock()
+        # Retention matrix, updated incrementally on every request
+        self.cohort_engine = CohortEngine()
         self._create_tables()
+        self.settings.load(self.connection)
+    
+    def _open_connection(self, readonly=False):
+        connection = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+        # In WAL mode a commit is durable after the next checkpoint with NORMAL,
+        # the database itself can't be corrupted by a crash
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute(f"PRAGMA cache_size = {-self.cache_size_mb * 1024}")
+        connection.execute(f"PRAGMA mmap_size = {self.mmap_size_mb * 1024 * 1024}")
+        if readonly:
+            connection.execute("PRAGMA query_only = ON")
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+    
+    @property
+    def connection(self):
+        """Connection owned by the current thread"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._open_connection()
+            self._local.connection = connection
+        return connection
+    
+    def open_reader(self):
+        """Give the current thread a read-only connection, used as the initializer of read pool threads"""
+        self._local.connection = self._open_connection(readonly=True)
+    
+    @property
+    def cursor(self):
+        """Cursor bound to the current thread's connection"""
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self.connection.cursor()
+            self._local.cursor = cursor
+        return cursor
     
     def _create_tables(self):
-        """Create necessary tables if they don't exist"""
-        # Users table
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            registration_date TIMESTAMP
-        )
-        ''')
-        
-        # Button clicks tracking
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS button_clicks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            button_name TEXT,
-            click_time TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users(user_id)
-        )
-        ''')
-        
-        # Settings for welcome message and link
-        self.cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-        ''')
-        
-        # Initialize default settings if they don't exist
-        self.cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", 
-                           ("welcome_text", "Welcome to our bot!"))
-        self.cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", 
-                           ("welcome_link", "https://example.com"))
-        self.cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", 
-                           ("welcome_link_text", "Visit our website"))
-        
-        self.connection.commit()
+        """Create or upgrade tables to the latest schema version"""
+        if get_schema_version(self.connection) == 0:
+            # Only takes effect before the first table is created, older
+            # databases are converted offline with `python -m db.vacuum`
+            self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # Stored in the file: readers no longer block the writer and the other way round
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        apply_migrations(self.connection)
     
     def add_user(self, user_id, username=None, first_name=None, last_name=None):
         """Add new user to database or ignore if already exists"""
-        self.cursor.execute(
-            "INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, registration_date) VALUES (?, ?, ?, ?, ?)",
-            (user_id, username, first_name, last_name, datetime.now())
-        )
-        self.connection.commit()
+        self.write_batch(users=[(user_id, username, first_name, last_name, datetime.now())])
     
     def record_button_click(self, user_id, button_name):
         """Record when a user clicks a button"""
-        self.cursor.execute(
-            "INSERT INTO button_clicks (user_id, button_name, click_time) VALUES (?, ?, ?)",
-            (user_id, button_name, datetime.now())
+        self.write_batch(clicks=[(user_id, button_name, datetime.now())])
+    
+    def write_batch(self, users=(), clicks=()):
+        """
+        Insert buffered users and button clicks in a single transaction
+        :param users: rows of (user_id, username, first_name, last_name, registration_date)
+        :param clicks: rows of (user_id, button_name, click_time)
+        """
+        with self.connection:
+            # Take the write lock up front, so batches from several worker processes
+            # wait on busy_timeout instead of failing halfway through a transaction
+            self.connection.execute("BEGIN IMMEDIATE")
+            if users:
+                self.cursor.executemany(
+                    "INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, registration_date) VALUES (?, ?, ?, ?, ?)",
+                    users
+                )
+                # rowcount of executemany is the number of users actually inserted
+                self.cursor.execute(
+                    "UPDATE counters SET value = value + ? WHERE name = 'users'",
+                    (self.cursor.rowcount,)
+                )
+            if clicks:
+                self.cursor.executemany(
+                    "INSERT INTO button_clicks (user_id, button_name, click_time) VALUES (?, ?, ?)",
+                    clicks
+                )
+                self._update_rollups(clicks)
+                self._update_totals(clicks)
+                self._update_sketches(clicks)
+    
+    def _update_totals(self, clicks):
+        """Add clicks to the per-button and per-user totals, must run inside the insert transaction"""
+        buttons = Counter(button_name for _, button_name, _ in clicks)
+        self.cursor.executemany(
+            """
+            INSERT INTO button_totals (button_name, clicks) VALUES (?, ?)
+            ON CONFLICT (button_name) DO UPDATE SET clicks = clicks + excluded.clicks
+            """,
+            buttons.items()
+        )
+        users = Counter(user_id for user_id, _, _ in clicks)
+        self.cursor.executemany(
+            """
+            INSERT INTO user_totals (user_id, clicks) VALUES (?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET clicks = clicks + excluded.clicks
+            """,
+            users.items()
+        )
+    
+    def _update_sketches(self, clicks):
+        """Add clicking users to the daily HyperLogLog sketches, must run inside the insert transaction"""
+        days = {}
+        for user_id, _, click_time in clicks:
+            days.setdefault(click_time.strftime("%Y-%m-%d"), set()).add(user_id)
+        for day, user_ids in days.items():
+            self.cursor.execute("SELECT registers FROM daily_user_sketches WHERE day = ?", (day,))
+            row = self.cursor.fetchone()
+            sketch = HyperLogLog.from_bytes(row[0]) if row else HyperLogLog()
+            sketch.update(user_ids)
+            self.cursor.execute(
+                "INSERT OR REPLACE INTO daily_user_sketches (day, registers) VALUES (?, ?)",
+                (day, sketch.to_bytes())
+            )
+    
+    def _update_rollups(self, clicks):
+        """Add clicks to the hourly rollups, must run inside the insert transaction"""
+        buckets = Counter(
+            (click_time.strftime(BUCKET_FORMAT), button_name)
+            for _, button_name, click_time in clicks
+        )
+        self.cursor.executemany(
+            """
+            INSERT INTO click_rollups (bucket, button_name, clicks) VALUES (?, ?, ?)
+            ON CONFLICT (bucket, button_name) DO UPDATE SET clicks = clicks + excluded.clicks
+            """,
+            [(bucket, button_name, count) for (bucket, button_name), count in buckets.items()]
         )
-        self.connection.commit()
     
     def get_user_stats(self, user_id):
-        """Get statistics for a specific user"""
+        """Get statistics for a specific user, raw and archived clicks together"""
         self.cursor.execute(
-            "SELECT button_name, COUNT(*) FROM button_clicks WHERE user_id = ? GROUP BY button_name",
-            (user_id,)
+            """
+            SELECT button_name, SUM(clicks) FROM (
+                SELECT button_name, COUNT(*) AS clicks FROM button_clicks WHERE user_id = ? GROUP BY button_name
+                UNION ALL
+                SELECT button_name, clicks FROM click_archive WHERE user_id = ?
+            )
+            GROUP BY button_name
+            """,
+            (user_id, user_id)
         )
         return self.cursor.fetchall()
     
     def get_button_stats(self):
         """Get overall button click statistics"""
         self.cursor.execute(
-            "SELECT button_name, COUNT(*) FROM button_clicks GROUP BY button_name ORDER BY COUNT(*) DESC"
+            "SELECT button_name, clicks FROM button_totals ORDER BY clicks DESC"
         )
         return self.cursor.fetchall()
     
     def get_user_count(self):
         """Get total number of users"""
-        self.cursor.execute("SELECT COUNT(*) FROM users")
-        return self.cursor.fetchone()[0]
+        self.cursor.execute("SELECT value FROM counters WHERE name = 'users'")
+        result = self.cursor.fetchone()
+        return result[0] if result else 0
+    
+    def get_click_series(self, start, end, hourly=False, button_name=None):
+        """
+        Get click counts per hour or per day from the rollups
+        :param start: first datetime of the range (inclusive)
+        :param end: last datetime of the range (exclusive)
+        :param hourly: count per hour instead of per day
+        :param button_name: only count this button
+        :return: list of (datetime, count) for every hour or day, oldest first
+        """
+        # Buckets are "YYYY-MM-DD HH:00", the first 10 characters are the day
+        prefix = 13 if hourly else 10
+        query = f"""
+            SELECT substr(bucket, 1, {prefix}), SUM(clicks) FROM click_rollups
+            WHERE bucket >= ? AND bucket < ?
+        """
+        params = [start.strftime(BUCKET_FORMAT), end.strftime(BUCKET_FORMAT)]
+        if button_name is not None:
+            query += " AND button_name = ?"
+            params.append(button_name)
+        query += " GROUP BY 1"
+        self.cursor.execute(query, params)
+        counts = dict(self.cursor.fetchall())
+        
+        step = timedelta(hours=1) if hourly else timedelta(days=1)
+        key_format = "%Y-%m-%d %H" if hourly else "%Y-%m-%d"
+        result = []
+        current = start
+        while current < end:
+            result.append((current, counts.get(current.strftime(key_format), 0)))
+            current += step
+        return result
     
     def get_daily_stats(self, days=7):
         """Get daily statistics for the last N days"""
-        result = []
-        today = datetime.now().date()
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        series = self.get_click_series(today - timedelta(days=days - 1), today + timedelta(days=1))
         
-        # Generate stats for each of the last N days
-        for i in range(days):
-            target_date = today - timedelta(days=i)
-            start_date = datetime.combine(target_date, datetime.min.time())
-            end_date = datetime.combine(target_date, datetime.max.time())
-            
-            self.cursor.execute(
-                """
-                SELECT COUNT(*) FROM button_clicks 
-                WHERE click_time BETWEEN ? AND ?
-                """,
-                (start_date, end_date)
-            )
-            count = self.cursor.fetchone()[0]
-            
-            # Format as "DD.MM" (e.g., "01.05")
-            date_str = target_date.strftime("%d.%m")
-            result.append((date_str, count))
+        # Format as "DD.MM" (e.g., "01.05"), oldest first
+        return [(day.strftime("%d.%m"), count) for day, count in series]
+    
+    def get_hourly_stats(self, hours=24):
+        """Get hourly statistics for the last N hours"""
+        current_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+        series = self.get_click_series(
+            current_hour - timedelta(hours=hours - 1), current_hour + timedelta(hours=1), hourly=True
+        )
         
-        # Return in chronological order (oldest first)
-        return list(reversed(result))
+        # Format as "DD.MM HH:00", oldest first
+        return [(hour.strftime("%d.%m %H:00"), count) for hour, count in series]
     
     def get_most_active_users(self, limit=10):
         """Get the most active users based on button clicks"""
         self.cursor.execute(
             """
-            SELECT u.user_id, u.username, u.first_name, u.last_name, COUNT(b.id) as click_count
-            FROM users u
-            JOIN button_clicks b ON u.user_id = b.user_id
-            GROUP BY u.user_id
-            ORDER BY click_count DESC
+            SELECT u.user_id, u.username, u.first_name, u.last_name, t.clicks
+            FROM user_totals t
+            JOIN users u ON u.user_id = t.user_id
+            ORDER BY t.clicks DESC
             LIMIT ?
             """,
             (limit,)
         )
         return self.cursor.fetchall()
     
-    def get_active_users_count(self, days=7):
-        """Get count of active users in the last N days"""
-        target_date = datetime.now() - timedelta(days=days)
+    def get_active_users_count(self, days=7, exact=False):
+        """
+        Get count of active users in the last N calendar days, today included
+        :param exact: count distinct users in raw clicks instead of merging daily sketches
+        :return: estimated (or exact) number of distinct users
+        """
+        first_day = datetime.now().date() - timedelta(days=days - 1)
+        
+        if exact:
+            # Days older than the retention age only exist in the archive
+            self.cursor.execute(
+                """
+                SELECT COUNT(*) FROM (
+                    SELECT user_id FROM button_clicks WHERE click_time >= ?
+                    UNION
+                    SELECT user_id FROM click_archive WHERE day >= ?
+                )
+                """,
+                (datetime.combine(first_day, datetime.min.time()), first_day.strftime("%Y-%m-%d"))
+            )
+            return self.cursor.fetchone()[0]
         
         self.cursor.execute(
-            """
-            SELECT COUNT(DISTINCT user_id) FROM button_clicks
-            WHERE click_time >= ?
-            """,
-            (target_date,)
+            "SELECT registers FROM daily_user_sketches WHERE day >= ?",
+            (first_day.strftime("%Y-%m-%d"),)
         )
-        return self.cursor.fetchone()[0]
+        sketch = HyperLogLog()
+        for (registers,) in self.cursor.fetchall():
+            sketch.merge(HyperLogLog.from_bytes(registers))
+        return sketch.count()
+    
+    def get_retention_matrix(self, cohorts=8):
+        """
+        Weekly registration cohorts and how many of their users were active in each following week.
+        Only users and clicks added since the previous call are read.
+        :param cohorts: number of cohorts, the current week is the last one
+        :return: list of (first day of the cohort, users, [active users in week 0, 1, ...]), oldest first
+        """
+        self.cohort_engine.update(self.connection)
+        return self.cohort_engine.matrix(cohorts)
+    
+    # Retention methods, used by db.retention.RetentionJob
+    def archive_clicks(self, before, limit=2000):
+        """
+        Fold the oldest raw clicks into click_archive and delete them, in one short transaction.
+        Totals, rollups and sketches already contain these clicks and are not touched.
+        :param before: archive clicks older than this datetime
+        :param limit: max number of raw rows per call
+        :return: number of raw rows archived, 0 when nothing is left
+        """
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.cursor.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+            self.cursor.execute("DELETE FROM temp.archive_batch")
+            self.cursor.execute(
+                """
+                INSERT INTO temp.archive_batch (id)
+                SELECT id FROM button_clicks WHERE click_time < ? ORDER BY click_time LIMIT ?
+                """,
+                (before, limit)
+            )
+            archived = self.cursor.rowcount
+            if archived:
+                self.cursor.execute(
+                    """
+                    INSERT INTO click_archive (user_id, button_name, day, clicks)
+                    SELECT c.user_id, c.button_name, date(c.click_time), COUNT(*)
+                    FROM button_clicks c JOIN temp.archive_batch b ON b.id = c.id
+                    WHERE true
+                    GROUP BY 1, 2, 3
+                    ON CONFLICT (user_id, button_name, day) DO UPDATE SET clicks = clicks + excluded.clicks
+                    """
+                )
+                self.cursor.execute("DELETE FROM button_clicks WHERE id IN (SELECT id FROM temp.archive_batch)")
+                # Tells db.cohorts.CohortEngine to read the archive again
+                self.cursor.execute(
+                    """
+                    INSERT INTO counters (name, value) VALUES ('archived_clicks', ?)
+                    ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+                    """,
+                    (archived,)
+                )
+        return archived
+    
+    def incremental_vacuum_enabled(self):
+        """True if the database was created or converted with auto_vacuum = INCREMENTAL"""
+        return self.connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    
+    def enable_incremental_vacuum(self):
+        """
+        Switch a database created without auto_vacuum to incremental mode.
+        This needs a full VACUUM that rewrites the whole file and holds the write lock
+        until it's done, so it's only run by `python -m db.vacuum` while the bot is stopped.
+        :return: True if the database was converted
+        """
+        if self.incremental_vacuum_enabled():
+            return False
+        self.connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.connection.execute("VACUUM")
+        return True
+    
+    def incremental_vacuum(self, pages=1000):
+        """
+        Return up to `pages` free pages to the file system
+        :return: number of free pages left
+        """
+        self.connection.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        return self.connection.execute("PRAGMA freelist_count").fetchone()[0]
+    
+    # WAL checkpoints, run in the background by AsyncDatabase
+    def checkpoint(self, mode="PASSIVE"):
+        """
+        Copy committed pages from the WAL file back into the database.
+        Uses its own connection, so it doesn't wait for queries of other threads.
+        :param mode: one of CHECKPOINT_MODES, PASSIVE never blocks readers or writers
+        :return: (1 if it couldn't finish, frames in the WAL, frames copied)
+        """
+        if mode not in CHECKPOINT_MODES:
+            raise ValueError(f"Unknown checkpoint mode: {mode}")
+        with self._checkpoint_lock:
+            if self._checkpoint_connection is None:
+                self._checkpoint_connection = self._open_connection()
+            return self._checkpoint_connection.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    
+    # Export methods
+    def get_export_chunk(self, name, after=None, limit=5000):
+        """
+        Get the next rows of an exported table in primary key order.
+        Every chunk is a separate short read, so an export never holds a lock
+        for long and writers keep committing between chunks.
+        :param name: key of EXPORT_TABLES
+        :param after: key of the last row of the previous chunk, None for the first chunk
+        :return: list of rows, the key of a row is its first key columns
+        """
+        table, key_size, columns = EXPORT_TABLES[name]
+        key = ", ".join(columns[:key_size])
+        query = f"SELECT {', '.join(columns)} FROM {table}"
+        params = []
+        if after is not None:
+            query += f" WHERE ({key}) > ({', '.join('?' * key_size)})"
+            params.extend(after)
+        query += f" ORDER BY {key} LIMIT ?"
+        params.append(limit)
+        self.cursor.execute(query, params)
+        return self.cursor.fetchall()
+    
+    # Broadcast methods
+    def create_broadcast(self, source_chat_id, source_message_id, report_chat_id=None):
+        """
+        Create a broadcast of a message to all users
+        :return: broadcast id
+        """
+        with self.connection:
+            self.cursor.execute(
+                """
+                INSERT INTO broadcasts (source_chat_id, source_message_id, report_chat_id, status, total, created_at)
+                VALUES (?, ?, ?, 'running', (SELECT COUNT(*) FROM users), ?)
+                """,
+                (source_chat_id, source_message_id, report_chat_id, datetime.now())
+            )
+        return self.cursor.lastrowid
+    
+    def get_broadcast(self, broadcast_id):
+        """Get a broadcast as a dict, or None if it doesn't exist"""
+        self.cursor.execute("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+        row = self.cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in self.cursor.description], row))
+    
+    def get_running_broadcasts(self):
+        """Get ids of broadcasts that were not finished"""
+        self.cursor.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [row[0] for row in self.cursor.fetchall()]
+    
+    def get_broadcast_recipients(self, after_user_id=0, limit=500):
+        """Get the next chunk of user ids ordered by id, starting after after_user_id"""
+        self.cursor.execute(
+            "SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (after_user_id, limit)
+        )
+        return [row[0] for row in self.cursor.fetchall()]
+    
+    def update_broadcast(self, broadcast_id, last_user_id, sent, failed, status="running"):
+        """Save broadcast progress"""
+        finished_at = None if status == "running" else datetime.now()
+        with self.connection:
+            self.cursor.execute(
+                """
+                UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ?, status = ?, finished_at = ?
+                WHERE id = ?
+                """,
+                (last_user_id, sent, failed, status, finished_at, broadcast_id)
+            )
+    
+    # FSM storage methods, used by db.fsm_storage.SQLiteStorage
+    def get_fsm_record(self, key):
+        """
+        Get the FSM state and data of a storage key
+        :return: (state, data as JSON text), both None if nothing is stored
+        """
+        self.cursor.execute("SELECT state, data FROM fsm_states WHERE key = ?", (key,))
+        return self.cursor.fetchone() or (None, None)
+    
+    def set_fsm_record(self, key, state, data):
+        """
+        Store the FSM state and data of a storage key, empty records are deleted
+        :param data: JSON text or None
+        """
+        with self.connection:
+            if state is None and data is None:
+                self.cursor.execute("DELETE FROM fsm_states WHERE key = ?", (key,))
+            else:
+                self.cursor.execute(
+                    "INSERT OR REPLACE INTO fsm_states (key, state, data) VALUES (?, ?, ?)",
+                    (key, state, data)
+                )
+    
+    # Settings methods, served from the in-memory cache
+    @property
+    def settings_version(self):
+        """Version of the cached settings, grows on every change"""
+        return self.settings.version
     
-    # Settings methods
     def get_welcome_message(self):
         """Get welcome message text"""
-        self.cursor.execute("SELECT value FROM settings WHERE key = 'welcome_text'")
-        result = self.cursor.fetchone()
-        return result[0] if result else "Welcome to our bot!"
+        return self.settings.get("welcome_text", "Welcome to our bot!")
     
     def get_welcome_link(self):
         """Get welcome link"""
-        self.cursor.execute("SELECT value FROM settings WHERE key = 'welcome_link'")
-        result = self.cursor.fetchone()
-        return result[0] if result else "https://example.com"
+        return self.settings.get("welcome_link", "https://example.com")
     
     def get_welcome_link_text(self):
         """Get welcome link button text"""
-        self.cursor.execute("SELECT value FROM settings WHERE key = 'welcome_link_text'")
-        result = self.cursor.fetchone()
-        return result[0] if result else "Visit our website"
+        return self.settings.get("welcome_link_text", "Visit our website")
     
     def update_setting(self, key, value):
-        """Update a setting value"""
-        self.cursor.execute("UPDATE settings SET value = ? WHERE key = ?", (value, key))
+        """Update or create a setting value and refresh the settings cache"""
+        self.cursor.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
         self.connection.commit()
+        self.settings.load(self.connection)
         return True
     
+    def delete_setting(self, key):
+        """Delete one setting and refresh the settings cache"""
+        self.cursor.execute("DELETE FROM settings WHERE key = ?", (key,))
+        self.connection.commit()
+        self.settings.load(self.connection)
+        return self.cursor.rowcount
+    
+    def delete_settings(self, prefix):
+        """Delete all settings whose key starts with prefix"""
+        self.cursor.execute("DELETE FROM settings WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+        self.connection.commit()
+        self.settings.load(self.connection)
+        return self.cursor.rowcount
+    
+    def refresh_settings(self):
+        """
+        Reload settings if the database was changed by another connection or process
+        :return: True if the cached settings changed
+        """
+        with self._watch_lock:
+            if self._watch_connection is None:
+                self._watch_connection = self._open_connection()
+            # data_version changes whenever another connection commits
+            data_version = self._watch_connection.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._watch_data_version:
+                return False
+            self._watch_data_version = data_version
+            return self.settings.load(self._watch_connection)
+    
     def close(self):
-        """Close the database connection"""
-        if self.connection:
-            self.connection.close() 
\ No newline at end of file
+        """Close all database connections"""
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        self._watch_connection = None
+        self._checkpoint_connection = None
+        for connection in connections:
+            connection.close() 
\ No newline at end of file
@@ -0,0 +1,68 @@
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey, StateType
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage in the fsm_states table, shared by all worker processes.
+
+    Records are cached in a write-through LRU. This is only correct while
+    every update of a chat is handled by the same process, which is how
+    utils.workers routes updates; the cache also keeps the per-update
+    state lookup of aiogram's FSM middleware off the database.
+    """
+    def __init__(self, db, max_cached=10000):
+        """
+        :param db: AsyncDatabase instance
+        :param max_cached: number of records kept in memory
+        """
+        self._db = db
+        self.max_cached = max_cached
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = OrderedDict()
+
+    async def _get(self, key: StorageKey):
+        """Get (state, data) of a key, from the cache if possible"""
+        record_key = self.key_builder.build(key)
+        record = self._cache.get(record_key)
+        if record is None:
+            state, data = await self._db.get_fsm_record(record_key)
+            record = (state, json.loads(data) if data else {})
+            self._remember(record_key, record)
+        else:
+            self._cache.move_to_end(record_key)
+        return record
+
+    async def _set(self, key: StorageKey, state, data):
+        record_key = self.key_builder.build(key)
+        await self._db.set_fsm_record(record_key, state, json.dumps(data, ensure_ascii=False) if data else None)
+        self._remember(record_key, (state, data))
+
+    def _remember(self, record_key, record):
+        self._cache[record_key] = record
+        self._cache.move_to_end(record_key)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._get(key)
+        await self._set(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        state, _ = await self._get(key)
+        await self._set(key, state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(key)
+        return dict(data)
+
+    async def close(self) -> None:
+        self._cache.clear()
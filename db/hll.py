@@ -0,0 +1,70 @@
+import hashlib
+import math
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter.
+    With the default precision of 12 it takes 4 KB and the standard
+    error of an estimate is 1.04 / sqrt(4096), about 1.6%.
+    Sketches with the same precision merge by taking register maxima.
+    """
+    def __init__(self, precision=12, registers=None):
+        self.precision = precision
+        self.size = 1 << precision
+        if registers is None:
+            self.registers = bytearray(self.size)
+        else:
+            if len(registers) != self.size:
+                raise ValueError(f"Expected {self.size} registers, got {len(registers)}")
+            self.registers = bytearray(registers)
+
+    @property
+    def error(self):
+        """Relative standard error of an estimate"""
+        return 1.04 / math.sqrt(self.size)
+
+    @staticmethod
+    def _hash(value):
+        # Stable across processes, unlike the builtin hash()
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "big")
+
+    def add(self, value):
+        """Add a value to the sketch"""
+        x = self._hash(value)
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        # Position of the leftmost 1-bit in the remaining 64 - p bits
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values):
+        """Add many values to the sketch"""
+        for value in values:
+            self.add(value)
+
+    def merge(self, other):
+        """Merge another sketch into this one"""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        """Estimate the number of distinct values"""
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        # Linear counting is more accurate for small cardinalities
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(precision=int(math.log2(len(data))), registers=data)
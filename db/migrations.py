@@ -0,0 +1,217 @@
+"""
+Versioned schema migrations.
+The applied version is kept in PRAGMA user_version, every migration runs
+in its own transaction and is never edited once released: add a new one instead.
+A step is either an SQL statement or a callable taking the connection.
+"""
+from loguru import logger
+
+from db.hll import HyperLogLog
+
+
+def backfill_user_sketches(connection):
+    """Build daily_user_sketches from the raw clicks, one day at a time"""
+    sketches = {}
+    rows = connection.execute(
+        "SELECT DISTINCT date(click_time), user_id FROM button_clicks WHERE click_time IS NOT NULL"
+    )
+    for day, user_id in rows:
+        sketches.setdefault(day, HyperLogLog()).add(user_id)
+    connection.executemany(
+        "INSERT OR REPLACE INTO daily_user_sketches (day, registers) VALUES (?, ?)",
+        [(day, sketch.to_bytes()) for day, sketch in sketches.items()]
+    )
+
+
+MIGRATIONS = [
+    (1, [
+        # Users table
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            registration_date TIMESTAMP
+        )
+        ''',
+        # Button clicks tracking
+        '''
+        CREATE TABLE IF NOT EXISTS button_clicks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            button_name TEXT,
+            click_time TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(user_id)
+        )
+        ''',
+        # Settings for welcome message and link
+        '''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+        ''',
+        # Default settings
+        "INSERT OR IGNORE INTO settings (key, value) VALUES ('welcome_text', 'Welcome to our bot!')",
+        "INSERT OR IGNORE INTO settings (key, value) VALUES ('welcome_link', 'https://example.com')",
+        "INSERT OR IGNORE INTO settings (key, value) VALUES ('welcome_link_text', 'Visit our website')",
+    ]),
+    (2, [
+        # Covers get_daily_stats and get_active_users_count
+        "CREATE INDEX IF NOT EXISTS idx_button_clicks_time ON button_clicks (click_time, user_id)",
+        # Covers get_user_stats and get_most_active_users
+        "CREATE INDEX IF NOT EXISTS idx_button_clicks_user ON button_clicks (user_id, button_name)",
+        # Covers get_button_stats
+        "CREATE INDEX IF NOT EXISTS idx_button_clicks_button ON button_clicks (button_name)",
+    ]),
+    (3, [
+        # Hourly click counts per button, kept up to date by Database.write_batch
+        '''
+        CREATE TABLE IF NOT EXISTS click_rollups (
+            bucket TEXT NOT NULL,
+            button_name TEXT NOT NULL,
+            clicks INTEGER NOT NULL,
+            PRIMARY KEY (bucket, button_name)
+        ) WITHOUT ROWID
+        ''',
+        # One-time backfill from the raw clicks
+        '''
+        INSERT INTO click_rollups (bucket, button_name, clicks)
+        SELECT strftime('%Y-%m-%d %H:00', click_time), button_name, COUNT(*)
+        FROM button_clicks
+        WHERE click_time IS NOT NULL AND button_name IS NOT NULL
+        GROUP BY 1, 2
+        ''',
+    ]),
+    (4, [
+        # Counters maintained by Database.write_batch
+        "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID",
+        '''
+        CREATE TABLE IF NOT EXISTS button_totals (
+            button_name TEXT PRIMARY KEY,
+            clicks INTEGER NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS user_totals (
+            user_id INTEGER PRIMARY KEY,
+            clicks INTEGER NOT NULL
+        )
+        ''',
+        # Top-K of the most active users reads the first K index entries
+        "CREATE INDEX IF NOT EXISTS idx_user_totals_clicks ON user_totals (clicks DESC)",
+        # One-time backfill
+        "INSERT OR REPLACE INTO counters (name, value) SELECT 'users', COUNT(*) FROM users",
+        '''
+        INSERT INTO button_totals (button_name, clicks)
+        SELECT button_name, COUNT(*) FROM button_clicks
+        WHERE button_name IS NOT NULL
+        GROUP BY button_name
+        ''',
+        '''
+        INSERT INTO user_totals (user_id, clicks)
+        SELECT user_id, COUNT(*) FROM button_clicks
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+        ''',
+    ]),
+    (5, [
+        # HyperLogLog sketch of distinct active users per day
+        '''
+        CREATE TABLE IF NOT EXISTS daily_user_sketches (
+            day TEXT PRIMARY KEY,
+            registers BLOB NOT NULL
+        ) WITHOUT ROWID
+        ''',
+        backfill_user_sketches,
+    ]),
+    (6, [
+        # Broadcasts and their progress, so a restart resumes instead of resending
+        '''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_chat_id INTEGER NOT NULL,
+            source_message_id INTEGER NOT NULL,
+            report_chat_id INTEGER,
+            status TEXT NOT NULL,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        ''',
+    ]),
+    (7, [
+        # FSM states and data shared by worker processes
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (8, [
+        # Raw clicks past the retention age, folded into one row per day, user and button
+        '''
+        CREATE TABLE IF NOT EXISTS click_archive (
+            user_id INTEGER NOT NULL,
+            button_name TEXT NOT NULL,
+            day TEXT NOT NULL,
+            clicks INTEGER NOT NULL,
+            PRIMARY KEY (user_id, button_name, day)
+        ) WITHOUT ROWID
+        ''',
+        # Covers the exact active users count over archived days
+        "CREATE INDEX IF NOT EXISTS idx_click_archive_day ON click_archive (day, user_id)",
+    ]),
+    (9, [
+        # Lets the retention cohorts read only recently registered users
+        "CREATE INDEX IF NOT EXISTS idx_users_registration ON users (registration_date)",
+    ]),
+    (10, [
+        # get_button_stats reads button_totals now, nothing looks up raw clicks by button.
+        # idx_button_clicks_user stays: get_user_stats still reads a user's raw clicks by it
+        "DROP INDEX IF EXISTS idx_button_clicks_button",
+    ]),
+]
+
+
+def get_schema_version(connection):
+    """Get the schema version of a database"""
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(connection, migrations=MIGRATIONS):
+    """
+    Apply all migrations newer than the database schema version
+    :param connection: sqlite3 connection
+    :return: schema version after migrating
+    """
+    version = get_schema_version(connection)
+    for target, steps in migrations:
+        if target <= version:
+            continue
+        # IMMEDIATE takes the write lock, so concurrent processes migrate one at a time
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = get_schema_version(connection)
+            if target <= version:
+                connection.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(connection)
+                else:
+                    connection.execute(step)
+            connection.execute(f"PRAGMA user_version = {target}")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        version = target
+        logger.info(f"Database migrated to schema version {version}")
+    return version
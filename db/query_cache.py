@@ -0,0 +1,75 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Result cache for read queries with a TTL per entry and bounded size.
+
+    Concurrent requests for the same key share a single computation.
+    Entries are tagged with the tables they read: invalidate() bumps the
+    generation of a table, which makes every entry and every computation
+    still in flight that read it stale. Cached values are shared between
+    callers and must not be modified.
+    """
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        # key -> (expires at, generation of its tables, value)
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _generation(self, tables):
+        return tuple(self._generations.get(table, 0) for table in tables)
+
+    async def get(self, key, ttl, compute, tables=()):
+        """
+        Get a cached value or compute it
+        :param ttl: seconds the value stays valid
+        :param compute: coroutine function computing the value
+        :param tables: tables the value is read from
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, generation, value = entry
+            if expires > time.monotonic() and generation == self._generation(tables):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        # A computation started before the last write is not shared with later requests
+        inflight_key = (key, self._generation(tables))
+        future = self._inflight.get(inflight_key)
+        if future is None:
+            self.misses += 1
+            future = asyncio.ensure_future(self._compute(key, ttl, compute, tables))
+            self._inflight[inflight_key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(inflight_key, None))
+        else:
+            self.coalesced += 1
+        # One caller being cancelled must not cancel the others
+        return await asyncio.shield(future)
+
+    async def _compute(self, key, ttl, compute, tables):
+        generation = self._generation(tables)
+        value = await compute()
+        # Tables written while computing make the value stale already
+        if generation == self._generation(tables):
+            self._entries[key] = (time.monotonic() + ttl, generation, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *tables):
+        """Mark everything read from these tables as stale"""
+        for table in tables:
+            self._generations[table] = self._generations.get(table, 0) + 1
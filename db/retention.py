@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from loguru import logger
+
+from utils.metrics import metrics
+
+
+class RetentionJob:
+    """
+    Periodically moves raw clicks older than `days` into click_archive
+    and gives the freed pages back to the file system.
+
+    Work is done in small transactions with pauses between them,
+    so the write-behind buffer never waits long for the write lock.
+    """
+    def __init__(self, db, days=90, batch_size=2000, interval=3600, pause=0.1, vacuum_pages=1000):
+        """
+        :param db: AsyncDatabase instance
+        :param days: age after which raw clicks are archived
+        :param batch_size: raw rows archived per transaction
+        :param interval: seconds between runs
+        :param pause: seconds between two transactions of a run
+        :param vacuum_pages: pages freed per incremental vacuum step
+        """
+        self._db = db
+        self.days = days
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.archived = 0
+        self._task = None
+        metrics.counter("bot_clicks_archived_total", lambda: self.archived, "Raw clicks moved to click_archive")
+
+    def start(self):
+        """Start the background job, must be called from a running loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        if not await self._db.incremental_vacuum_enabled():
+            logger.warning(
+                "Database has no incremental auto_vacuum, archived clicks free pages inside the file only. "
+                "Stop the bot and run `python -m db.vacuum <database>` to return them to the file system"
+            )
+        while True:
+            try:
+                await self.run()
+            except Exception:
+                logger.exception("Retention run failed, will retry")
+            await asyncio.sleep(self.interval)
+
+    async def run(self):
+        """
+        Archive everything older than the retention age, then vacuum
+        :return: number of raw rows archived
+        """
+        before = datetime.now() - timedelta(days=self.days)
+        archived = 0
+        while True:
+            count = await self._db.archive_clicks(before, self.batch_size)
+            archived += count
+            self.archived += count
+            if count < self.batch_size:
+                break
+            await asyncio.sleep(self.pause)
+
+        # Stops when nothing is left. Without incremental auto_vacuum the
+        # pragma does nothing, free pages are reused by new rows instead
+        free_pages = None
+        while await self._db.incremental_vacuum_enabled():
+            left = await self._db.incremental_vacuum(self.vacuum_pages)
+            if not left or left == free_pages:
+                break
+            free_pages = left
+            await asyncio.sleep(self.pause)
+
+        if archived:
+            logger.info(f"Archived {archived} clicks older than {before:%Y-%m-%d}")
+        return archived
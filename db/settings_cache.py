@@ -0,0 +1,36 @@
+import threading
+from types import MappingProxyType
+
+
+class SettingsCache:
+    """
+    In-memory copy of the settings table.
+    Readers get an immutable snapshot, reloads swap it in one assignment,
+    and version grows every time the contents actually change.
+    """
+    def __init__(self):
+        self._values = MappingProxyType({})
+        self._lock = threading.Lock()
+        self.version = 0
+
+    def get(self, key, default=None):
+        """Get a cached setting value"""
+        return self._values.get(key, default)
+
+    def snapshot(self):
+        """Get all cached settings as a read-only mapping"""
+        return self._values
+
+    def load(self, connection):
+        """
+        Reload all settings from the database
+        :param connection: sqlite3 connection to read from
+        :return: True if the contents changed
+        """
+        with self._lock:
+            values = dict(connection.execute("SELECT key, value FROM settings").fetchall())
+            if values == self._values:
+                return False
+            self._values = MappingProxyType(values)
+            self.version += 1
+            return True
@@ -0,0 +1,45 @@
+"""
+Switch a database created without auto_vacuum to incremental mode, so the
+retention job can give the pages of archived clicks back to the file system.
+
+Rewrites the whole file with VACUUM: it needs free disk space about the size
+of the database and holds the write lock until it's done. Stop the bot first.
+
+    python -m db.vacuum data/db.sqlite
+"""
+import argparse
+import os
+import sys
+import time
+
+from loguru import logger
+
+from db.database import Database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db", nargs="+", help="database files to convert")
+    args = parser.parse_args()
+
+    for path in args.db:
+        if not os.path.exists(path):
+            logger.error(f"{path} doesn't exist")
+            sys.exit(1)
+        db = Database(path)
+        try:
+            started = time.perf_counter()
+            size = os.path.getsize(path)
+            if db.enable_incremental_vacuum():
+                logger.info(
+                    f"{path} converted in {time.perf_counter() - started:.1f}s, "
+                    f"{size // 1024 // 1024} MB -> {os.path.getsize(path) // 1024 // 1024} MB"
+                )
+            else:
+                logger.info(f"{path} already uses incremental auto_vacuum")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+
+from loguru import logger
+
+
+class WriteBehindBuffer:
+    """
+    Collects user upserts and button clicks in memory and writes them
+    in one transaction, either when the buffer is full or when the
+    flush interval elapses.
+
+    A failed batch is retried on the next flush. After max_attempts failures
+    in a row its rows are written one at a time and the ones that still fail
+    are dropped, so one bad row can't hold back the others forever. While
+    max_pending rows are waiting, adding more waits for a flush.
+    """
+    def __init__(self, flush_func, max_size=500, flush_interval=0.5, max_pending=50000, max_attempts=5,
+                 retry_errors=(sqlite3.OperationalError,)):
+        """
+        :param flush_func: coroutine function taking (users, clicks) lists
+        :param max_size: number of pending rows that triggers an early flush
+        :param flush_interval: max seconds a row stays in memory
+        :param max_pending: number of pending rows at which callers have to wait
+        :param max_attempts: failed flushes in a row before rows are written one by one
+        :param retry_errors: errors of the database itself rather than of a row
+                             (locked, disk full), rows are never dropped for them
+        """
+        self._flush_func = flush_func
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.retry_errors = retry_errors
+        self.dropped = 0
+        self._failures = 0
+        self._users = {}
+        self._clicks = []
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._room.set()
+        self._task = None
+        self._closing = False
+
+    def __len__(self):
+        return len(self._users) + len(self._clicks)
+
+    async def add_user(self, user_id, username=None, first_name=None, last_name=None):
+        """Queue a user insert, the first registration in a batch wins"""
+        if user_id not in self._users:
+            await self._wait_for_room()
+            self._users.setdefault(user_id, (user_id, username, first_name, last_name, datetime.now()))
+            self._check_size()
+
+    async def add_click(self, user_id, button_name):
+        """Queue a button click"""
+        await self._wait_for_room()
+        self._clicks.append((user_id, button_name, datetime.now()))
+        self._check_size()
+
+    async def _wait_for_room(self):
+        while len(self) >= self.max_pending:
+            self._room.clear()
+            self._wakeup.set()
+            await self._room.wait()
+
+    def _check_size(self):
+        if len(self) >= self.max_size:
+            self._wakeup.set()
+
+    def start(self):
+        """Start the background flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write everything queued so far"""
+        async with self._flush_lock:
+            if not len(self):
+                return
+            users, self._users = self._users, {}
+            clicks, self._clicks = self._clicks, []
+            try:
+                await self._flush_func(list(users.values()), clicks)
+                self._failures = 0
+            except Exception:
+                self._failures += 1
+                if self._failures < self.max_attempts:
+                    logger.exception(f"Failed to flush {len(users)} users and {len(clicks)} clicks, will retry")
+                    self._put_back(users.values(), clicks)
+                else:
+                    logger.exception(
+                        f"Failed to flush {len(users)} users and {len(clicks)} clicks {self._failures} times, "
+                        f"writing them one by one"
+                    )
+                    self._failures = 0
+                    await self._flush_rows(list(users.values()), clicks)
+            finally:
+                if len(self) < self.max_pending:
+                    self._room.set()
+
+    async def _flush_rows(self, users, clicks):
+        """Write rows one per transaction, dropping the ones that fail"""
+        rows = [([row], []) for row in users] + [([], [row]) for row in clicks]
+        for index, (user_rows, click_rows) in enumerate(rows):
+            try:
+                await self._flush_func(user_rows, click_rows)
+            except self.retry_errors:
+                # The database fails, not the row: keep the rest for the next flush
+                logger.exception("Database is unavailable, will retry")
+                rest = rows[index:]
+                self._put_back(
+                    [row for user_rows, _ in rest for row in user_rows],
+                    [row for _, click_rows in rest for row in click_rows]
+                )
+                return
+            except Exception:
+                self.dropped += 1
+                logger.exception(f"Dropped a row that can't be written: {(user_rows or click_rows)[0]!r}")
+
+    def _put_back(self, users, clicks):
+        """Return rows of a failed flush in front of anything queued meanwhile"""
+        queued = self._users
+        self._users = {row[0]: row for row in users}
+        for user_id, row in queued.items():
+            self._users.setdefault(user_id, row)
+        self._clicks = list(clicks) + self._clicks
+
+    async def close(self):
+        """Stop the flush loop and drain the queue"""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
@@ -1,13 +1,20 @@
 from aiogram import Router, Bot, F
-from aiogram.types import Message, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
+from aiogram.types import Message, FSInputFile
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
+import asyncio
 import os
 import io
 from datetime import datetime, timedelta
 
 from utils.isadmin import IsAdmin
 from utils.states import AdminSettings
+from handlers.users import WELCOME_PHOTO, image_id
+from utils.metrics import metrics, HANDLER_SECONDS, DB_SECONDS, API_SECONDS
+from utils.scheduler import PRIORITY_HIGH
+from utils.export import FORMATS, export_table, export_filename
+from utils.config import TELEGRAM_API_URL
+from db.database import EXPORT_TABLES
 
 router_admin = Router()
 
@@ -19,15 +26,94 @@ ADMIN_COMMANDS = [
     "/admin - Показать это меню",
     "/stats_users - Количество пользователей",
     "/stats_buttons - Статистика нажатий кнопок",
-    "/stats_chart - Графическая статистика нажатий",
-    "/stats_daily - Ежедневная статистика",
-    "/stats_active - Активные пользователи",
+    "/stats_chart [кнопок] - График нажатий кнопок",
+    "/stats_daily [дней | с [по]] - График по дням",
+    "/stats_hourly [часов] - Почасовая статистика",
+    "/stats_active [exact] - Активные пользователи",
+    "/stats_retention [недель] - Удержание по неделям регистрации",
+    "/stats_perf - Задержки обработчиков, базы и Bot API",
+    "/export [csv|jsonl] [users|clicks|archive] - Выгрузка данных",
     "/set_welcome - Изменить приветственное сообщение",
     "/set_link - Изменить ссылку",
     "/set_link_text - Изменить текст кнопки-ссылки",
-    "/view_welcome - Просмотреть текущее приветствие"
+    "/set_photo - Изменить картинку приветствия",
+    "/view_welcome - Просмотреть текущее приветствие",
+    "/broadcast - Рассылка сообщения всем пользователям",
+    "/broadcast_stop <номер> - Остановить рассылку"
 ]
 
+# Ограничения, чтобы ответ поместился в одно сообщение Telegram
+MAX_HOURLY_HOURS = 72
+
+# Столько недельных когорт помещается в строку таблицы удержания
+MAX_RETENTION_WEEKS = 12
+
+# Ограничения, чтобы график оставался читаемым
+MAX_DAILY_DAYS = 366
+MAX_CHART_BUTTONS = 30
+
+# Максимальный размер файла, который бот может отправить (у локального Bot API сервера больше)
+MAX_UPLOAD_SIZE = (2000 if TELEGRAM_API_URL else 50) * 1024 * 1024
+
+# Одновременно выполняется только одна выгрузка
+export_lock = asyncio.Lock()
+
+def parse_int_arg(command: CommandObject, default, max_value):
+    """
+    Parse an optional positive integer command argument
+    :return: the number clamped to 1..max_value, or default if it is missing or invalid
+    """
+    if command is None or not command.args:
+        return default
+    try:
+        value = int(command.args.split()[0])
+    except ValueError:
+        return default
+    return max(1, min(value, max_value))
+
+def parse_date(text):
+    """Parse a date as DD.MM.YYYY or YYYY-MM-DD, None if it's neither"""
+    for date_format in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            pass
+    return None
+
+def parse_date_range(command: CommandObject, default_days, max_days):
+    """
+    Parse "<days>", "<from>" or "<from> <to>" command arguments into whole days
+    :return: (start, end) datetimes with end exclusive, at most max_days long,
+             or None if the arguments are invalid
+    """
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    args = command.args.split() if command is not None and command.args else []
+    if not args or (len(args) == 1 and args[0].isdigit()):
+        days = parse_int_arg(command, default_days, max_days)
+        return today - timedelta(days=days - 1), today + timedelta(days=1)
+    
+    dates = [parse_date(arg) for arg in args[:2]]
+    if None in dates:
+        return None
+    start = dates[0]
+    end = (dates[1] if len(dates) > 1 else today) + timedelta(days=1)
+    if end <= start:
+        return None
+    return start, min(end, start + timedelta(days=max_days))
+
+def format_activity_bars(stats):
+    """
+    Format (label, count) pairs as a text bar chart
+    """
+    result = ""
+    for label, count in stats:
+        # Create a simple bar chart
+        bar_length = int(count / 5) + 1  # Scale: 1 block per 5 clicks, minimum 1
+        bar = "█" * min(bar_length, 20)  # Cap at 20 blocks
+        
+        result += f"{label}: {bar} {count}\n"
+    return result
+
 async def send_admin_panel(message: Message):
     """
     Отправляет панель администратора
@@ -51,7 +137,7 @@ async def get_user_count(message: Message, bot: Bot, db=None):
     :return: None
     """
     if db:
-        user_count = db.get_user_count()
+        user_count = await db.get_user_count()
         await message.reply(f"Всего пользователей в базе: {user_count}")
     else:
         await message.reply("База данных не инициализирована.")
@@ -72,7 +158,7 @@ async def get_button_stats(message: Message, bot: Bot, db=None):
         await send_admin_panel(message)
         return
         
-    stats = db.get_button_stats()
+    stats = await db.get_button_stats()
     if not stats:
         await message.reply("Нет данных о нажатиях кнопок.")
         await send_admin_panel(message)
@@ -87,12 +173,14 @@ async def get_button_stats(message: Message, bot: Bot, db=None):
     # Показываем админ-панель
     await send_admin_panel(message)
 
-async def get_button_stats_chart(message: Message, bot: Bot, db=None):
+async def get_button_stats_chart(message: Message, bot: Bot, db=None, command: CommandObject = None, charts=None):
     """
-    Get statistics on button clicks as a text-based chart
+    Get statistics on button clicks as a bar chart image
     :param message: Message instance
     :param bot: Bot instance
     :param db: Database instance
+    :param command: parsed command, the optional argument is the number of buttons
+    :param charts: ChartRenderer instance
     :return: None
     """
     if not db:
@@ -100,43 +188,33 @@ async def get_button_stats_chart(message: Message, bot: Bot, db=None):
         await send_admin_panel(message)
         return
         
-    stats = db.get_button_stats()
+    stats = await db.get_button_stats()
     if not stats:
         await message.reply("Нет данных о нажатиях кнопок.")
         await send_admin_panel(message)
         return
     
-    # Find the maximum count for scaling
-    max_count = max([count for _, count in stats])
+    # Top buttons, sorted by clicks
+    limit = parse_int_arg(command, 10, MAX_CHART_BUTTONS)
+    top_stats = stats[:limit]
     
-    # Create a text-based chart
-    result = "📊 Статистика нажатий кнопок (график):\n\n"
-    
-    # Limit to top 10 buttons for readability
-    top_stats = stats[:10]
-    
-    # Calculate the maximum width of button names for alignment
-    max_name_width = max([len(button_name) for button_name, _ in top_stats])
-    
-    for button_name, count in top_stats:
-        # Scale the bar to a maximum of 20 characters
-        bar_length = int((count / max_count) * 20)
-        bar = "█" * bar_length
-        
-        # Format with proper alignment
-        result += f"{button_name.ljust(max_name_width)} | {bar} {count}\n"
-    
-    await message.reply(result)
+    await charts.send(
+        bot, message.chat.id, "bar", f"Нажатия кнопок, топ {len(top_stats)}",
+        [button_name for button_name, _ in top_stats], [count for _, count in top_stats],
+        caption=f"📊 Всего нажатий: {sum(count for _, count in stats)}, кнопок: {len(stats)}"
+    )
     
     # Показываем админ-панель
     await send_admin_panel(message)
 
-async def get_daily_stats(message: Message, bot: Bot, db=None):
+async def get_daily_stats(message: Message, bot: Bot, db=None, command: CommandObject = None, charts=None):
     """
-    Get daily statistics on button clicks for the last 7 days
+    Get daily statistics on button clicks as a chart image, for the last 7 days by default
     :param message: Message instance
     :param bot: Bot instance
     :param db: Database instance
+    :param command: parsed command, the number of days or a date range
+    :param charts: ChartRenderer instance
     :return: None
     """
     if not db:
@@ -144,34 +222,64 @@ async def get_daily_stats(message: Message, bot: Bot, db=None):
         await send_admin_panel(message)
         return
     
-    # Get daily stats for the last 7 days
-    daily_stats = db.get_daily_stats()
+    date_range = parse_date_range(command, 7, MAX_DAILY_DAYS)
+    if date_range is None:
+        await message.reply(
+            "Укажите число дней или период: /stats_daily 30, /stats_daily 01.09.2025 30.09.2025"
+        )
+        return
+    start, end = date_range
+    series = await db.get_click_series(start, end)
+    
+    last_day = end - timedelta(days=1)
+    title = f"Нажатия по дням, {start:%d.%m.%Y} - {last_day:%d.%m.%Y}"
+    total = sum(count for _, count in series)
+    busiest_day, busiest_count = max(series, key=lambda item: item[1])
+    
+    await charts.send(
+        bot, message.chat.id, "series", title,
+        [day.strftime("%d.%m") for day, _ in series], [count for _, count in series],
+        caption=(
+            f"📅 Всего нажатий: {total}, в среднем {total / len(series):.1f} в день\n"
+            f"Больше всего: {busiest_day:%d.%m.%Y} ({busiest_count})"
+        )
+    )
     
-    if not daily_stats:
-        await message.reply("Нет данных о ежедневной активности.")
+    # Показываем админ-панель
+    await send_admin_panel(message)
+
+async def get_hourly_stats(message: Message, bot: Bot, db=None, command: CommandObject = None):
+    """
+    Get hourly statistics on button clicks, for the last 24 hours by default
+    :param message: Message instance
+    :param bot: Bot instance
+    :param db: Database instance
+    :param command: parsed command, the optional argument is the number of hours
+    :return: None
+    """
+    if not db:
+        await message.reply("База данных не инициализирована.")
         await send_admin_panel(message)
         return
     
-    result = "📅 Статистика активности за последние 7 дней:\n\n"
+    hours = parse_int_arg(command, 24, MAX_HOURLY_HOURS)
+    hourly_stats = await db.get_hourly_stats(hours)
     
-    for date_str, count in daily_stats:
-        # Create a simple bar chart
-        bar_length = int(count / 5) + 1  # Scale: 1 block per 5 clicks, minimum 1
-        bar = "█" * min(bar_length, 20)  # Cap at 20 blocks
-        
-        result += f"{date_str}: {bar} {count}\n"
+    result = f"🕐 Статистика активности за последние {hours} ч.:\n\n"
+    result += format_activity_bars(hourly_stats)
     
     await message.reply(result)
     
     # Показываем админ-панель
     await send_admin_panel(message)
 
-async def get_active_users(message: Message, bot: Bot, db=None):
+async def get_active_users(message: Message, bot: Bot, db=None, command: CommandObject = None):
     """
-    Get list of most active users
+    Get list of most active users and distinct active user counts
     :param message: Message instance
     :param bot: Bot instance
     :param db: Database instance
+    :param command: parsed command, "/stats_active exact" counts without sketches
     :return: None
     """
     if not db:
@@ -179,7 +287,7 @@ async def get_active_users(message: Message, bot: Bot, db=None):
         await send_admin_panel(message)
         return
     
-    active_users = db.get_most_active_users(limit=10)
+    active_users = await db.get_most_active_users(limit=10)
     
     if not active_users:
         await message.reply("Нет данных об активных пользователях.")
@@ -192,41 +300,150 @@ async def get_active_users(message: Message, bot: Bot, db=None):
         user_display = username or f"{first_name} {last_name}".strip() or f"ID: {user_id}"
         result += f"{i}. {user_display}: {click_count} действий\n"
     
+    # Уникальные пользователи за день/неделю/месяц, по умолчанию оценка по HyperLogLog
+    exact = command is not None and command.args == "exact"
+    result += "\nУникальных активных пользователей" + (":\n" if exact else " (оценка, ±2%):\n")
+    for label, days in (("за сегодня", 1), ("за 7 дней", 7), ("за 30 дней", 30)):
+        count = await db.get_active_users_count(days, exact=exact)
+        result += f"{label}: {count}\n"
+    
     await message.reply(result)
     
     # Показываем админ-панель
     await send_admin_panel(message)
 
-async def view_welcome(message: Message, bot: Bot, db=None):
+def format_retention_table(matrix):
     """
-    View current welcome message and link
+    Format cohorts as a monospaced table: cohort week, users, share active in week 0, 1, ...
+    """
+    weeks = max(len(counts) for _, _, counts in matrix)
+    result = "Неделя Польз. " + "".join(f"{week:>5}" for week in range(weeks)) + "\n"
+    for start, users, counts in matrix:
+        cells = "".join(f"{round(100 * count / users):>4}%" if users else "    -" for count in counts)
+        result += f"{start:%d.%m}  {users:>6} {cells}\n"
+    return result
+
+async def get_retention_stats(message: Message, bot: Bot, db=None, command: CommandObject = None):
+    """
+    Get retention of weekly registration cohorts, for the last 8 weeks by default
+    :param message: Message instance
+    :param bot: Bot instance
+    :param db: Database instance
+    :param command: parsed command, the optional argument is the number of weeks
+    :return: None
     """
     if not db:
         await message.reply("База данных не инициализирована.")
         await send_admin_panel(message)
         return
     
-    welcome_text = db.get_welcome_message()
-    welcome_link = db.get_welcome_link()
-    welcome_link_text = db.get_welcome_link_text()
+    weeks = parse_int_arg(command, 8, MAX_RETENTION_WEEKS)
+    matrix = await db.get_retention_matrix(weeks)
     
-    # Create inline keyboard with link button to preview how it looks
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=welcome_link_text, url=welcome_link)]
-        ]
+    result = (
+        f"📈 Удержание за {weeks} нед.: доля пользователей, зарегистрированных на неделе, "
+        f"которые были активны через 0, 1, 2... недели после регистрации\n\n"
     )
+    result += f"<pre>{format_retention_table(matrix)}</pre>"
+    
+    await message.reply(result)
+    
+    # Показываем админ-панель
+    await send_admin_panel(message)
+
+def format_latency_table(title, histograms, limit=10):
+    """
+    Format histograms as lines of "name: count, p50, p99", busiest first
+    """
+    if not histograms:
+        return ""
+    result = f"{title}:\n"
+    busiest = sorted(histograms.items(), key=lambda item: item[1].count, reverse=True)[:limit]
+    for name, histogram in busiest:
+        p50 = histogram.quantile(0.5) * 1000
+        p99 = histogram.quantile(0.99) * 1000
+        result += f"{name}: {histogram.count} шт., p50 {p50:.1f} мс, p99 {p99:.1f} мс\n"
+    return result + "\n"
+
+async def get_perf_stats(message: Message, scheduler=None):
+    """
+    Show latency percentiles of handlers, database methods and Bot API requests
+    :param scheduler: UpdateScheduler, to show the update queue
+    """
+    result = "⏱ Производительность с момента запуска:\n\n"
+    if scheduler is not None:
+        result += (
+            f"Обновлений в работе: {scheduler.running}/{scheduler.workers}, "
+            f"в очереди: {scheduler.queued()} (админов: {scheduler.queued(PRIORITY_HIGH)}), "
+            f"отброшено: {sum(scheduler.shed)}\n\n"
+        )
+    result += format_latency_table("Обработчики", metrics.histograms(HANDLER_SECONDS))
+    result += format_latency_table("База данных", metrics.histograms(DB_SECONDS))
+    result += format_latency_table("Bot API", metrics.histograms(API_SECONDS))
+    
+    await message.reply(result)
+    
+    # Показываем админ-панель
+    await send_admin_panel(message)
+
+async def export_cmd(message: Message, bot: Bot, db=None, command: CommandObject = None):
+    """
+    Export tables as gzip-compressed CSV or JSON Lines documents
+    :param command: parsed command, "/export jsonl clicks" picks the format and the tables
+    """
+    if not db:
+        await message.reply("База данных не инициализирована.")
+        await send_admin_panel(message)
+        return
+    
+    args = command.args.split() if command is not None and command.args else []
+    fmt = next((arg for arg in args if arg in FORMATS), "csv")
+    tables = [arg for arg in args if arg in EXPORT_TABLES] or list(EXPORT_TABLES)
+    
+    if export_lock.locked():
+        await message.reply("Выгрузка уже выполняется, подождите.")
+        return
+    
+    async with export_lock:
+        await message.reply(f"Готовлю выгрузку ({fmt}): {', '.join(tables)}...")
+        for name in tables:
+            path, rows = await export_table(db, name, fmt)
+            try:
+                if os.path.getsize(path) > MAX_UPLOAD_SIZE:
+                    await message.reply(f"{name}: файл больше {MAX_UPLOAD_SIZE // 1024 // 1024} МБ, Telegram его не примет.")
+                    continue
+                await message.answer_document(
+                    FSInputFile(path, filename=export_filename(name, fmt)),
+                    caption=f"{name}: {rows} строк"
+                )
+            finally:
+                os.remove(path)
+    
+    # Показываем админ-панель
+    await send_admin_panel(message)
+
+async def view_welcome(message: Message, bot: Bot, db=None, welcome=None, media=None):
+    """
+    View current welcome message and link
+    """
+    if not db:
+        await message.reply("База данных не инициализирована.")
+        await send_admin_panel(message)
+        return
+    
+    # Same prebuilt response that users get on /start
+    response = await welcome.get()
     
     info_text = (
         f"📋 Текущие настройки приветствия:\n\n"
-        f"Текст сообщения:\n{welcome_text}\n\n"
-        f"Текст кнопки: {welcome_link_text}\n"
-        f"Ссылка: {welcome_link}\n\n"
+        f"Текст сообщения:\n{response.caption}\n\n"
+        f"Текст кнопки: {response.link_text}\n"
+        f"Ссылка: {response.link}\n\n"
         f"👇 Предварительный просмотр:"
     )
     
     await message.reply(info_text)
-    await message.answer(welcome_text, reply_markup=keyboard)
+    await media.send_photo(bot, message.chat.id, WELCOME_PHOTO, default=image_id, **response.fields)
     
     # Показываем админ-панель
     await send_admin_panel(message)
@@ -252,6 +469,13 @@ async def set_link_text_cmd(message: Message, state: FSMContext):
     await message.reply("Пожалуйста, введите новый текст для кнопки-ссылки:")
     await state.set_state(AdminSettings.WAITING_FOR_LINK_TEXT)
 
+async def set_photo_cmd(message: Message, state: FSMContext):
+    """
+    Set new welcome photo
+    """
+    await message.reply("Пожалуйста, отправьте новую картинку для приветствия:")
+    await state.set_state(AdminSettings.WAITING_FOR_PHOTO)
+
 async def process_welcome_text(message: Message, state: FSMContext, db=None):
     """
     Process new welcome text
@@ -263,7 +487,7 @@ async def process_welcome_text(message: Message, state: FSMContext, db=None):
         return
     
     new_text = message.text
-    db.update_setting("welcome_text", new_text)
+    await db.update_setting("welcome_text", new_text)
     
     await message.reply(f"✅ Текст приветствия успешно обновлен!\n\nНовый текст:\n{new_text}")
     await state.clear()
@@ -288,7 +512,7 @@ async def process_welcome_link(message: Message, state: FSMContext, db=None):
         await message.reply("❌ Ссылка должна начинаться с http:// или https://\nПожалуйста, попробуйте снова:")
         return
     
-    db.update_setting("welcome_link", new_link)
+    await db.update_setting("welcome_link", new_link)
     
     await message.reply(f"✅ Ссылка успешно обновлена!\n\nНовая ссылка: {new_link}")
     await state.clear()
@@ -307,10 +531,60 @@ async def process_link_text(message: Message, state: FSMContext, db=None):
         return
     
     new_text = message.text
-    db.update_setting("welcome_link_text", new_text)
+    await db.update_setting("welcome_link_text", new_text)
     
     await message.reply(f"✅ Текст кнопки успешно обновлен!\n\nНовый текст: {new_text}")
     await state.clear()
     
     # Показываем админ-панель
     await send_admin_panel(message)
+
+async def process_photo(message: Message, bot: Bot, state: FSMContext, media=None):
+    """
+    Process new welcome photo
+    """
+    if not message.photo:
+        await message.reply("❌ Это не картинка. Пожалуйста, отправьте фото:")
+        return
+    
+    await media.replace(bot, WELCOME_PHOTO, message.photo[-1])
+    
+    await message.reply("✅ Картинка приветствия успешно обновлена!")
+    await state.clear()
+    
+    # Показываем админ-панель
+    await send_admin_panel(message)
+
+async def broadcast_cmd(message: Message, state: FSMContext):
+    """
+    Start a broadcast to all users
+    """
+    await message.reply("Отправьте сообщение, которое нужно разослать всем пользователям (или /cancel для отмены):")
+    await state.set_state(AdminSettings.WAITING_FOR_BROADCAST)
+
+async def process_broadcast(message: Message, bot: Bot, state: FSMContext, broadcaster=None):
+    """
+    Process the message to broadcast
+    """
+    await state.clear()
+    if message.text == "/cancel":
+        await message.reply("Рассылка отменена.")
+        await send_admin_panel(message)
+        return
+    
+    # The message is copied as is, so any content type works
+    broadcast_id = await broadcaster.start(bot, message.chat.id, message.message_id, report_chat_id=message.chat.id)
+    await message.reply(f"Рассылка #{broadcast_id} запущена. Остановить: /broadcast_stop {broadcast_id}")
+
+async def broadcast_stop_cmd(message: Message, broadcaster=None, command: CommandObject = None):
+    """
+    Stop a running broadcast
+    """
+    try:
+        broadcast_id = int(command.args)
+    except (TypeError, ValueError):
+        await message.reply("Укажите номер рассылки: /broadcast_stop <номер>")
+        return
+    
+    if not await broadcaster.stop(broadcast_id):
+        await message.reply(f"Рассылка #{broadcast_id} не выполняется.")
@@ -4,50 +4,74 @@ from functools import partial
 
 from handlers.users import router_users, on_start
 from handlers.admin import router_admin, get_user_count, get_button_stats, get_button_stats_chart
-from handlers.admin import get_daily_stats, get_active_users, view_welcome, admin_panel
+from handlers.admin import get_daily_stats, get_hourly_stats, get_active_users, get_retention_stats, view_welcome, admin_panel
 from handlers.admin import process_welcome_text, process_welcome_link, process_link_text
 from handlers.admin import set_welcome_cmd, set_link_cmd, set_link_text_cmd
+from handlers.admin import set_photo_cmd, process_photo
+from handlers.admin import broadcast_cmd, process_broadcast, broadcast_stop_cmd, get_perf_stats, export_cmd
 from utils.isadmin import IsAdmin
 from utils.states import AdminSettings
+from utils.charts import ChartRenderer
+from utils.config import THROTTLE_RATE, THROTTLE_BURST, THROTTLE_MAX_USERS
+from utils.metrics import metrics, HandlerMetricsMiddleware
+from utils.throttling import ThrottlingMiddleware
+from utils.log import LogContextMiddleware
 
 
-async def register_users(db):
-    """Register user handlers with database access"""
-    # Inject database instance into handler function
-    router_users.message.register(
-        partial(on_start, db=db),
-        Command("start")
-    )
+# Database, settings and admins of the bot that received an update (db, welcome, media,
+# broadcaster, admin_ids) are passed to handlers by utils.tenants.TenantMiddleware,
+# only the process-wide objects are bound here
+
+# The routers are module-level, registering twice would stack every middleware
+# (users throttled twice per update) and every handler
+_registered = False
+
+async def register_users():
+    """Register user handlers"""
+    router_users.message.register(on_start, Command("start"))
     # router_users.message.register(
     #     partial(get_image_info, db=db),
     #     F.photo
     # )
 
-async def register_admin_handlers(db):
-    """Register all admin handlers with database access"""
+async def register_admin_handlers(charts):
+    """Register all admin handlers"""
     # Регистрируем команды без базы данных
     router_admin.message.register(admin_panel, Command("admin"))
     router_admin.message.register(set_welcome_cmd, Command("set_welcome"))
     router_admin.message.register(set_link_cmd, Command("set_link"))
     router_admin.message.register(set_link_text_cmd, Command("set_link_text"))
+    router_admin.message.register(set_photo_cmd, Command("set_photo"))
+    router_admin.message.register(get_perf_stats, Command("stats_perf"))
+    router_admin.message.register(broadcast_cmd, Command("broadcast"))
+    router_admin.message.register(broadcast_stop_cmd, Command("broadcast_stop"))
     
     # Регистрируем функции с базой данных
     # Regular command handlers
     admin_commands = {
         "stats_users": get_user_count,
         "stats_buttons": get_button_stats,
-        "stats_chart": get_button_stats_chart,
-        "stats_daily": get_daily_stats,
+        "stats_hourly": get_hourly_stats,
         "stats_active": get_active_users,
-        "view_welcome": view_welcome
+        "stats_retention": get_retention_stats,
+        "export": export_cmd
     }
     
     # Register all admin command handlers
     for cmd, handler_func in admin_commands.items():
+        router_admin.message.register(handler_func, Command(cmd))
+    
+    # Charts are rendered in a process pool
+    chart_commands = {
+        "stats_chart": get_button_stats_chart,
+        "stats_daily": get_daily_stats
+    }
+    for cmd, handler_func in chart_commands.items():
         router_admin.message.register(
-            partial(handler_func, db=db),
+            partial(handler_func, charts=charts),
             Command(cmd)
         )
+    router_admin.message.register(view_welcome, Command("view_welcome"))
     
     # State handlers
     state_handlers = {
@@ -58,18 +82,39 @@ async def register_admin_handlers(db):
     
     # Register all state handlers
     for state, handler_func in state_handlers.items():
-        router_admin.message.register(
-            partial(handler_func, db=db),
-            state
-        )
+        router_admin.message.register(handler_func, state)
+    router_admin.message.register(process_photo, AdminSettings.WAITING_FOR_PHOTO)
+    router_admin.message.register(process_broadcast, AdminSettings.WAITING_FOR_BROADCAST)
 
 
-async def register_all_handlers(db):
-    """Register all handlers with database access"""
+async def register_all_handlers(charts=None):
+    """
+    Register all handlers
+    :param charts: ChartRenderer instance, a new one if not given
+    """
+    global _registered
+    if _registered:
+        return
+    _registered = True
+    
+    # Drop floods before they reach on_start and the database
+    throttling = ThrottlingMiddleware(THROTTLE_RATE, THROTTLE_BURST, THROTTLE_MAX_USERS)
+    router_users.message.middleware(throttling)
+    metrics.counter("bot_throttled_updates_total", lambda: throttling.dropped, "User updates dropped by throttling")
+    metrics.gauge("bot_throttled_users", lambda: len(throttling), "Users tracked by throttling")
+    
+    # Measure handler latency
+    router_users.message.middleware(HandlerMetricsMiddleware())
+    router_admin.message.middleware(HandlerMetricsMiddleware())
+    
+    # Tag log records with the handler name
+    router_users.message.middleware(LogContextMiddleware())
+    router_admin.message.middleware(LogContextMiddleware())
+    
     # Register user handlers
-    await register_users(db)
+    await register_users()
     
     # Register admin handlers
-    await register_admin_handlers(db)
+    await register_admin_handlers(charts or ChartRenderer())
 
 
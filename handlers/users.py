@@ -2,19 +2,24 @@
 
 
 from aiogram import Router, Bot
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 
 router_users = Router()
 
+# Picture name in utils.media.MediaRegistry
+WELCOME_PHOTO = "welcome"
+# Used until a welcome picture is uploaded with /set_photo
 image_id = "AgACAgIAAxkBAAOVaHQjB5ZbiMXKiwqctevgbvlF-QQAAgv3MRs8dKBLNvr_enc5b90BAAMCAAN5AAM2BA"
 
 # Remove the decorator since we register this function manually in register_routers.py
-async def on_start(message: Message, bot: Bot, state: FSMContext, db=None):
+async def on_start(message: Message, bot: Bot, state: FSMContext, db=None, welcome=None, media=None):
     """
     Main start handler
     :param db: Database instance
+    :param welcome: WelcomeResponseCache instance
+    :param media: MediaRegistry instance
     :param state: FSM context
     :param message: Message instance
     :param bot: Bot instance
@@ -22,25 +27,16 @@ async def on_start(message: Message, bot: Bot, state: FSMContext, db=None):
     """
     # Add user to database
     user = message.from_user
-    db.add_user(user.id, user.username, user.first_name, user.last_name)
+    await db.add_user(user.id, user.username, user.first_name, user.last_name)
     
     # Record button click
-    db.record_button_click(user.id, "start")
+    await db.record_button_click(user.id, "start")
     
-    # Get welcome message and link from database
-    welcome_text = db.get_welcome_message()
-    welcome_link = db.get_welcome_link()
-    welcome_link_text = db.get_welcome_link_text()
-    
-    # Create inline keyboard with link button
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text=welcome_link_text, url=welcome_link)]
-        ]
-    )
+    # Welcome message with link button is prebuilt for the current settings
+    response = await welcome.get()
     
     # Send welcome message with link button
-    await bot.send_photo(message.chat.id, image_id, caption=welcome_text, reply_markup=keyboard)
+    await media.send_photo(bot, message.chat.id, WELCOME_PHOTO, default=image_id, **response.fields)
 
 
 # async def get_image_info(message: Message, bot: Bot, state: FSMContext, db=None):
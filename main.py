@@ -1,8 +1,13 @@
 import asyncio
+import signal
 
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import TelegramAPIServer
 
-from utils.config import TOKEN
+from utils.config import TELEGRAM_API_URL, BROADCAST_RATE, BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT
+from utils.config import METRICS_HOST, METRICS_PORT, WORKERS, RETENTION_DAYS, RETENTION_BATCH, BOTS_CONFIG
+from utils.config import DB_READERS, DB_CACHE_MB, DB_MMAP_MB, DB_CHECKPOINT_INTERVAL
+from utils.config import API_POOL_SIZE, API_RATE, API_MAX_RETRIES, SCHEDULER_WORKERS, SCHEDULER_QUEUE
 from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from loguru import logger
@@ -10,40 +15,196 @@ from handlers.register_routers import register_all_handlers
 from handlers.users import router_users
 from handlers.admin import router_admin
 from db.database import Database
+from db.async_database import AsyncDatabase
+from db.fsm_storage import SQLiteStorage
+from db.retention import RetentionJob
+from utils.webhook import run_webhook
+from utils.broadcast import Broadcaster
+from utils.metrics import ApiMetricsMiddleware, run_metrics_server
+from utils.session import BotApiSession
+from utils.scheduler import UpdateScheduler
+from utils.log import setup_logging, LogContextMiddleware
+from utils.charts import ChartRenderer
+from utils.tenants import Tenant, TenantMiddleware, load_bot_configs
+from utils.workers import WorkerPool, ForwardToWorkersMiddleware, consume_updates, worker_index
 
 
-"""Настраиваем логи"""
-logger.add('DEBUG.log', format="{time} {level} {message}", filter="my_module", level="ERROR")
-logger.add('DEBUG.log', format="{time} {level} {message}", filter="my_module", level="INFO")
-logger.add('DEBUG.log', format="{time} {level} {message}", filter="my_module", level="DEBUG")
+def create_session(rate=API_RATE):
+    """
+    HTTP session with metrics, shared by all bots of the process
+    :param rate: Bot API requests per second per bot
+    """
+    # Without TELEGRAM_API_URL requests go to api.telegram.org
+    api = {"api": TelegramAPIServer.from_base(TELEGRAM_API_URL)} if TELEGRAM_API_URL else {}
+    session = BotApiSession(pool_size=API_POOL_SIZE, rate=rate, max_retries=API_MAX_RETRIES, **api)
+    session.middleware(ApiMetricsMiddleware())
+    return session
 
-# Initialize bot
-bot = Bot(TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
+def create_bot(token, session=None):
+    return Bot(token, session=session or create_session(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 
-async def main() -> None:
-    # Initialize database
-    db = Database()
-    
-    dp = Dispatcher()
+
+def create_tenant(config, bot, broadcast_rate=BROADCAST_RATE, retention=True):
+    """
+    Database, broadcaster and background jobs of one bot, started
+    :param retention: archive old clicks of this bot's database in this process
+    """
+    db = AsyncDatabase(
+        Database(config.db_file, cache_size_mb=DB_CACHE_MB, mmap_size_mb=DB_MMAP_MB),
+        readers=DB_READERS, checkpoint_interval=DB_CHECKPOINT_INTERVAL
+    )
+    retention_job = RetentionJob(db, RETENTION_DAYS, RETENTION_BATCH) if retention and RETENTION_DAYS else None
+    tenant = Tenant(config, bot, db, Broadcaster(db, rate=broadcast_rate), retention_job)
+    tenant.start()
+    return tenant
+
+
+async def create_dispatcher(tenants, charts, storage=None):
+    """Dispatcher with all handlers registered, serving the bots of the tenants"""
+    dp = Dispatcher(storage=storage) if storage else Dispatcher()
+    # Tag log records with the update id
+    dp.update.outer_middleware(LogContextMiddleware())
+    # Pass the database, settings and admins of the receiving bot to handlers
+    dp.update.outer_middleware(TenantMiddleware(tenants))
+    # Limit concurrent updates, admins first, shed user updates on overload
+    dp.update.outer_middleware(UpdateScheduler(SCHEDULER_WORKERS, SCHEDULER_QUEUE))
     
-    # Register all handlers with database instance
-    await register_all_handlers(db)
+    # Register all handlers
+    await register_all_handlers(charts)
     
     # Include routers
     dp.include_router(router_users)
     dp.include_router(router_admin)
+    return dp
+
+
+async def receive_updates(bots, dp):
+    """Get updates from Telegram for all bots in the configured mode until stopped"""
+    logger.info(f"{len(bots)} bot(s) started in {BOT_MODE} mode")
+    if BOT_MODE == "webhook":
+        await run_webhook(
+            dp, bots, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH,
+            url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET
+        )
+    else:
+        # getUpdates doesn't work while a webhook is set
+        for bot in bots:
+            await bot.delete_webhook()
+        await dp.start_polling(*bots)
+
+
+async def run_worker(index, workers, updates_queue) -> None:
+    """Worker process: handles the updates of its chats sent by the ingress process"""
+    config = load_bot_configs(BOTS_CONFIG)[0]
+    # Every worker sends its own replies, the bot's limit is split between them
+    bot = create_bot(config.token, create_session(rate=API_RATE / workers))
+    # One process is enough to prune the shared database
+    tenant = create_tenant(config, bot, broadcast_rate=BROADCAST_RATE / workers, retention=index == 0)
+    
+    charts = ChartRenderer()
+    charts.start()
+    dp = await create_dispatcher([tenant], charts, storage=SQLiteStorage(tenant.db))
+    
+    metrics_task = None
+    if METRICS_PORT:
+        metrics_task = asyncio.create_task(run_metrics_server(METRICS_HOST, METRICS_PORT + 1 + index))
+    
+    logger.info(f"Worker {index} started")
+    try:
+        # A broadcast belongs to the worker of the admin chat that started it,
+        # so /broadcast_stop from that chat reaches it
+        await tenant.broadcaster.resume(
+            bot, owns=lambda broadcast: worker_index(broadcast["report_chat_id"], workers) == index
+        )
+        await consume_updates(dp, bot, updates_queue)
+    finally:
+        if metrics_task:
+            metrics_task.cancel()
+        await charts.close()
+        await dp.storage.close()
+        await tenant.close()
+        await bot.session.close()
+        logger.info(f"Worker {index} stopped")
+
+
+def worker_process(index, workers, updates_queue):
+    # Ctrl+C reaches the whole process group, workers stop when the ingress tells them to
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    setup_logging(f"worker-{index}")
+    asyncio.run(run_worker(index, workers, updates_queue))
+
+
+async def run_ingress(config) -> None:
+    """Ingress process: receives updates and hands them to WORKERS worker processes"""
+    bot = create_bot(config.token)
+    # Apply migrations once before the workers open the database
+    Database(config.db_file).close()
+    
+    pool = WorkerPool(WORKERS, worker_process)
+    pool.start()
+    
+    dp = Dispatcher()
+    dp.update.outer_middleware(ForwardToWorkersMiddleware(pool))
+    
+    metrics_task = None
+    if METRICS_PORT:
+        metrics_task = asyncio.create_task(run_metrics_server(METRICS_HOST, METRICS_PORT))
+    
+    try:
+        await receive_updates([bot], dp)
+    finally:
+        if metrics_task:
+            metrics_task.cancel()
+        
+        # Workers finish the queued updates, then drain and close their databases
+        await pool.close()
+        await bot.session.close()
+        logger.info("Bot stopped")
+
+
+async def main() -> None:
+    configs = load_bot_configs(BOTS_CONFIG)
+    if WORKERS:
+        if len(configs) > 1:
+            raise RuntimeError("WORKERS mode serves a single bot, remove the extra bots from BOTS_CONFIG")
+        await run_ingress(configs[0])
+        return
+    
+    # All bots share one HTTP session, dispatcher and chart renderer,
+    # databases, settings and admins are separate for every bot
+    session = create_session()
+    tenants = [create_tenant(config, create_bot(config.token, session)) for config in configs]
+    
+    charts = ChartRenderer()
+    charts.start()
+    dp = await create_dispatcher(tenants, charts)
+    
+    metrics_task = None
+    if METRICS_PORT:
+        metrics_task = asyncio.create_task(run_metrics_server(METRICS_HOST, METRICS_PORT))
     
-    logger.info("Bot started")
     try:
-        await dp.start_polling(bot)
+        # Continue broadcasts interrupted by the previous shutdown
+        for tenant in tenants:
+            await tenant.broadcaster.resume(tenant.bot)
+        await receive_updates([tenant.bot for tenant in tenants], dp)
     finally:
-        # Close database connection when bot stops
-        db.close()
+        if metrics_task:
+            metrics_task.cancel()
+        await charts.close()
+        
+        # Pause broadcasts (their progress is saved), write out buffered inserts
+        # and close database connections when bot stops
+        for tenant in tenants:
+            await tenant.close()
+        await session.close()
         logger.info("Bot stopped")
 
 
 if __name__ == "__main__":
+    # Настраиваем логи
+    setup_logging()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
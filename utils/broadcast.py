@@ -0,0 +1,215 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramForbiddenError,
+    TelegramNetworkError, TelegramRetryAfter,
+)
+from loguru import logger
+
+from utils.ratelimit import TokenBucket, ChatPacer
+
+
+class Broadcaster:
+    """
+    Copies a message to every registered user.
+    Recipients are read from the users table in chunks ordered by user_id,
+    sends go through a global rate limit and per-chat pacing, and progress
+    is saved every `save_every` messages, so after a restart the broadcast
+    continues from the last saved user instead of starting over.
+    """
+    def __init__(self, db, rate=25, chat_interval=1.0, chunk_size=500,
+                 save_every=50, report_interval=30, max_attempts=3):
+        """
+        :param db: AsyncDatabase instance
+        :param rate: messages per second for all broadcasts together
+        :param chat_interval: min seconds between two messages to the same chat
+        :param report_interval: seconds between progress reports to the admin
+        """
+        self._db = db
+        self.limiter = TokenBucket(rate)
+        self.pacer = ChatPacer(chat_interval)
+        self.chunk_size = chunk_size
+        self.save_every = save_every
+        self.report_interval = report_interval
+        self.max_attempts = max_attempts
+        self._tasks = {}
+        # Broadcasts cancelled by an admin, as opposed to paused by shutdown
+        self._stopping = set()
+
+    def is_running(self, broadcast_id):
+        return broadcast_id in self._tasks
+
+    async def start(self, bot: Bot, source_chat_id, source_message_id, report_chat_id=None):
+        """
+        Create a broadcast and start sending it in the background
+        :return: broadcast id
+        """
+        broadcast_id = await self._db.create_broadcast(source_chat_id, source_message_id, report_chat_id)
+        self._spawn(bot, broadcast_id)
+        return broadcast_id
+
+    async def resume(self, bot: Bot, owns=None):
+        """
+        Continue broadcasts interrupted by a restart
+        :param owns: function taking a broadcast dict, only matching broadcasts are resumed
+        """
+        for broadcast_id in await self._db.get_running_broadcasts():
+            if owns is not None and not owns(await self._db.get_broadcast(broadcast_id)):
+                continue
+            if not self.is_running(broadcast_id):
+                logger.info(f"Resuming broadcast {broadcast_id}")
+                self._spawn(bot, broadcast_id)
+
+    async def stop(self, broadcast_id):
+        """
+        Cancel a running broadcast
+        :return: False if it wasn't running
+        """
+        task = self._tasks.get(broadcast_id)
+        if task is None:
+            return False
+        self._stopping.add(broadcast_id)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        self._stopping.discard(broadcast_id)
+        return True
+
+    async def close(self):
+        """Pause all broadcasts, they resume on the next start"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _spawn(self, bot, broadcast_id):
+        task = asyncio.create_task(self._run(bot, broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, bot: Bot, broadcast_id):
+        broadcast = await self._db.get_broadcast(broadcast_id)
+        progress = BroadcastProgress(broadcast)
+        report_chat_id = broadcast["report_chat_id"]
+        status = "running"
+        try:
+            report = await self._report(bot, report_chat_id, progress)
+            while True:
+                recipients = await self._db.get_broadcast_recipients(progress.last_user_id, self.chunk_size)
+                if not recipients:
+                    break
+                for user_id in recipients:
+                    if await self._send(bot, user_id, broadcast):
+                        progress.sent += 1
+                    else:
+                        progress.failed += 1
+                    progress.last_user_id = user_id
+
+                    if progress.done_since_start % self.save_every == 0:
+                        await self._save(broadcast_id, progress, status)
+                    if time.monotonic() - progress.reported_at >= self.report_interval:
+                        report = await self._report(bot, report_chat_id, progress, report)
+            status = "finished"
+        except Exception:
+            logger.exception(f"Broadcast {broadcast_id} failed, it will resume on restart")
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            # A shutdown cancels the task too, keep it running so it resumes
+            if status == "cancelled" and broadcast_id not in self._stopping:
+                status = "running"
+            await asyncio.shield(self._save(broadcast_id, progress, status))
+            if status != "running":
+                await self._report(bot, report_chat_id, progress, final=status)
+
+    async def _send(self, bot: Bot, chat_id, broadcast):
+        """
+        Copy the broadcast message to a chat
+        :return: True if the message was delivered
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            await self.limiter.acquire()
+            await self.pacer.wait(chat_id)
+            try:
+                await bot.copy_message(chat_id, broadcast["source_chat_id"], broadcast["source_message_id"])
+                return True
+            except TelegramRetryAfter as e:
+                # Flood control applies to the whole bot, pause everything
+                logger.warning(f"Broadcast hit flood control, sleeping {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest):
+                # User blocked the bot or the chat doesn't exist anymore
+                return False
+            except (TelegramNetworkError, TelegramAPIError) as e:
+                logger.warning(f"Broadcast to {chat_id} failed, attempt {attempt}: {e}")
+                await asyncio.sleep(attempt)
+        return False
+
+    async def _save(self, broadcast_id, progress, status):
+        await self._db.update_broadcast(
+            broadcast_id, progress.last_user_id, progress.sent, progress.failed, status
+        )
+
+    async def _report(self, bot: Bot, chat_id, progress, message=None, final=None):
+        """Send or update the progress message for the admin"""
+        progress.reported_at = time.monotonic()
+        if chat_id is None:
+            return None
+        text = progress.format(final)
+        try:
+            if message is None or final:
+                return await bot.send_message(chat_id, text)
+            await message.edit_text(text)
+        except TelegramAPIError as e:
+            logger.warning(f"Failed to report broadcast progress: {e}")
+        return message
+
+
+class BroadcastProgress:
+    """
+    Counters of a running broadcast and its speed since this process started it
+    """
+    def __init__(self, broadcast):
+        self.id = broadcast["id"]
+        self.total = broadcast["total"]
+        self.sent = broadcast["sent"]
+        self.failed = broadcast["failed"]
+        self.last_user_id = broadcast["last_user_id"]
+        self._done_at_start = self.done
+        self.started_at = time.monotonic()
+        self.reported_at = self.started_at
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+    @property
+    def done_since_start(self):
+        return self.done - self._done_at_start
+
+    @property
+    def rate(self):
+        """Messages per second"""
+        elapsed = time.monotonic() - self.started_at
+        return self.done_since_start / elapsed if elapsed > 0 else 0.0
+
+    def format(self, final=None):
+        if final == "finished":
+            header = f"✅ Рассылка #{self.id} завершена"
+        elif final == "cancelled":
+            header = f"⛔ Рассылка #{self.id} остановлена"
+        else:
+            header = f"📨 Рассылка #{self.id}"
+        text = (
+            f"{header}\n\n"
+            f"Отправлено: {self.sent}\n"
+            f"Ошибок: {self.failed}\n"
+            f"Обработано: {self.done} из ~{self.total}\n"
+            f"Скорость: {self.rate:.1f} сообщ./сек"
+        )
+        if not final and self.rate > 0:
+            remaining = max(self.total - self.done, 0)
+            text += f"\nОсталось примерно: {int(remaining / self.rate / 60) + 1} мин."
+        return text
@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+from loguru import logger
+
+from utils.media import is_file_id_error
+
+BAR_COLOR = "#3b82f6"
+
+
+def _figure(width, height):
+    # Imported here so only the rendering processes load matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt, plt.subplots(figsize=(width, height), dpi=100)
+
+
+def _integer_ticks(axis):
+    # Counts are whole numbers, don't label 0.5 clicks
+    from matplotlib.ticker import MaxNLocator
+    axis.set_major_locator(MaxNLocator(integer=True))
+
+
+def _warm_up():
+    # Importing matplotlib takes seconds, do it before the first chart is requested
+    _figure(1, 1)[0].close("all")
+
+
+def _to_png(plt, fig):
+    buffer = io.BytesIO()
+    fig.tight_layout()
+    fig.savefig(buffer, format="png")
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def render_bar_chart(title, labels, values):
+    """Render a horizontal bar chart, largest value on top, as PNG bytes"""
+    plt, (fig, ax) = _figure(8, max(2.5, 0.35 * len(labels) + 1.2))
+    positions = range(len(labels))
+    ax.barh(positions, values, color=BAR_COLOR)
+    ax.set_yticks(positions, labels)
+    ax.invert_yaxis()
+    ax.set_title(title)
+    ax.grid(axis="x", alpha=0.3)
+    _integer_ticks(ax.xaxis)
+    for position, value in zip(positions, values):
+        ax.annotate(f" {value}", (value, position), va="center", fontsize=8)
+    return _to_png(plt, fig)
+
+
+def render_series_chart(title, labels, values):
+    """Render counts per period as bars with date labels, as PNG bytes"""
+    plt, (fig, ax) = _figure(10, 4.5)
+    positions = range(len(labels))
+    ax.bar(positions, values, color=BAR_COLOR, width=0.8)
+    # At most ~15 labels, so they stay readable on long ranges
+    step = max(1, len(labels) // 15)
+    ax.set_xticks(positions[::step], labels[::step], rotation=45, ha="right")
+    ax.set_title(title)
+    ax.grid(axis="y", alpha=0.3)
+    _integer_ticks(ax.yaxis)
+    ax.margins(x=0.01)
+    return _to_png(plt, fig)
+
+
+RENDERERS = {
+    "bar": render_bar_chart,
+    "series": render_series_chart,
+}
+
+
+class ChartRenderer:
+    """
+    Renders PNG charts in a process pool and sends them as photos.
+
+    An image is identified by a hash of its kind, title and data, and the
+    file_id Telegram returns for it is cached: asking again for a chart whose
+    data didn't change is just a resend by file_id. Concurrent requests for the
+    same chart wait for a single render.
+    """
+    def __init__(self, max_workers=1, max_cached=256):
+        self.max_workers = max_workers
+        self.max_cached = max_cached
+        self._pool = None
+        # (bot id, fingerprint) -> file_id
+        self._file_ids = OrderedDict()
+        self._renders = {}
+
+    @staticmethod
+    def fingerprint(kind, title, labels, values):
+        """Hash identifying the image rendered from this data"""
+        return hashlib.sha1(repr((kind, title, list(labels), list(values))).encode()).hexdigest()
+
+    def start(self):
+        """Start the rendering processes in the background, otherwise they start on the first chart"""
+        for _ in range(self.max_workers):
+            self._get_pool().submit(_warm_up)
+
+    def _get_pool(self):
+        if self._pool is None:
+            # spawn: forking a process with a running loop and db threads is unsafe
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    async def render(self, kind, title, labels, values):
+        """
+        Render a chart without blocking the event loop
+        :param kind: key of RENDERERS
+        :return: PNG bytes
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._get_pool(), RENDERERS[kind], title, list(labels), list(values))
+        except BrokenProcessPool:
+            # A rendering process died (e.g. killed for memory), start new ones and try once more
+            logger.warning("Chart rendering pool is broken, restarting it")
+            pool, self._pool = self._pool, None
+            # Don't wait for the dead processes on the event loop
+            pool.shutdown(wait=False, cancel_futures=True)
+            return await loop.run_in_executor(self._get_pool(), RENDERERS[kind], title, list(labels), list(values))
+
+    async def send(self, bot: Bot, chat_id, kind, title, labels, values, **kwargs):
+        """
+        Send a chart as a photo, by cached file_id when the same chart was sent before
+        :return: sent Message
+        """
+        key = (bot.id, self.fingerprint(kind, title, labels, values))
+        file_id = self._file_ids.get(key)
+        if file_id:
+            self._file_ids.move_to_end(key)
+            try:
+                return await bot.send_photo(chat_id, file_id, **kwargs)
+            except TelegramBadRequest as e:
+                if not is_file_id_error(e):
+                    raise
+                logger.warning(f"Cached chart file_id rejected: {e}")
+                self._file_ids.pop(key, None)
+
+        render = self._renders.get(key)
+        if render is None:
+            render = asyncio.ensure_future(self.render(kind, title, labels, values))
+            self._renders[key] = render
+            render.add_done_callback(lambda _: self._renders.pop(key, None))
+        png = await asyncio.shield(render)
+
+        message = await bot.send_photo(chat_id, BufferedInputFile(png, filename="chart.png"), **kwargs)
+        self._file_ids[key] = message.photo[-1].file_id
+        while len(self._file_ids) > self.max_cached:
+            self._file_ids.popitem(last=False)
+        return message
+
+    async def close(self):
+        """Cancel queued renders and wait for the rendering processes to exit in a thread"""
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            await asyncio.to_thread(pool.shutdown, cancel_futures=True)
@@ -7,5 +7,77 @@ from loguru import logger
 TOKEN = os.environ.get('BOT_TOKEN')
 ADMIN_IDS = os.environ.get('ADMIN_IDS', '').split(',')
 
+# JSON файл со списком ботов, которых обслуживает один процесс:
+# [{"name": "congress", "token": "...", "admin_ids": [123], "db": "data/congress.sqlite"}]
+# У каждого бота своя база, настройки и админы. Пустое значение - один бот из BOT_TOKEN и ADMIN_IDS
+BOTS_CONFIG = os.environ.get('BOTS_CONFIG', '')
+
+# Адрес Bot API сервера, например локального telegram-bot-api или тестовой заглушки.
+# Пустое значение - api.telegram.org
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', '')
+
+# Исходящие запросы к Bot API: размер пула соединений, не больше API_RATE запросов
+# в секунду на бота (0 - без ограничения) и сколько раз повторять запрос после ответа 429
+API_POOL_SIZE = int(os.environ.get('API_POOL_SIZE', '100'))
+API_RATE = float(os.environ.get('API_RATE', '30'))
+API_MAX_RETRIES = int(os.environ.get('API_MAX_RETRIES', '3'))
+
+# Лимит рассылки, сообщений в секунду
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', '25'))
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.environ.get('BOT_MODE', 'polling')
+
+# Настройки webhook. Если WEBHOOK_URL пустой, webhook в Telegram не регистрируется,
+# сервер просто принимает POST запросы (удобно для локальной проверки)
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', '8080'))
+
+# Порт HTTP сервера с метриками в формате Prometheus (/metrics), 0 - выключен
+METRICS_HOST = os.environ.get('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+
+# Ограничение частоты для пользователей: THROTTLE_BURST сообщений подряд,
+# дальше THROTTLE_RATE сообщений в секунду, лишние отбрасываются
+THROTTLE_RATE = float(os.environ.get('THROTTLE_RATE', '1'))
+THROTTLE_BURST = int(os.environ.get('THROTTLE_BURST', '3'))
+THROTTLE_MAX_USERS = int(os.environ.get('THROTTLE_MAX_USERS', '100000'))
+
+# Одновременно обрабатывается не больше SCHEDULER_WORKERS обновлений, остальные ждут в очереди
+# (сначала админы и ответы на вопросы бота). Если в очереди уже SCHEDULER_QUEUE обновлений, новые отбрасываются
+SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS', '32'))
+SCHEDULER_QUEUE = int(os.environ.get('SCHEDULER_QUEUE', '1000'))
+
+# Количество процессов-обработчиков. 0 - всё в одном процессе, иначе основной
+# процесс только получает обновления и раздаёт их обработчикам по chat_id
+WORKERS = int(os.environ.get('WORKERS', '0'))
+
+# Клики старше RETENTION_DAYS дней сворачиваются в click_archive (по дню, пользователю и кнопке),
+# сырые строки удаляются пачками по RETENTION_BATCH. 0 - хранить всё
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', '90'))
+RETENTION_BATCH = int(os.environ.get('RETENTION_BATCH', '2000'))
+
+# База данных в режиме WAL: один поток пишет, DB_READERS соединений только для чтения
+# считают статистику. Кеш страниц на соединение и размер memory-mapped области в МБ,
+# раз в DB_CHECKPOINT_INTERVAL секунд WAL переносится в основной файл (0 - только автоматически)
+DB_READERS = int(os.environ.get('DB_READERS', '4'))
+DB_CACHE_MB = int(os.environ.get('DB_CACHE_MB', '32'))
+DB_MMAP_MB = int(os.environ.get('DB_MMAP_MB', '256'))
+DB_CHECKPOINT_INTERVAL = float(os.environ.get('DB_CHECKPOINT_INTERVAL', '30'))
+
+# Папка с локальными копиями картинок, file_id кешируются в settings
+MEDIA_DIR = os.environ.get('MEDIA_DIR', 'data/media')
+
+# Логи: уровень, файл с JSON записями, размер файла для ротации и сколько старых файлов хранить
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FILE = os.environ.get('LOG_FILE', 'data/logs/bot.log')
+LOG_ROTATION = os.environ.get('LOG_ROTATION', '10 MB')
+LOG_RETENTION = int(os.environ.get('LOG_RETENTION', '5'))
+# Сколько записей в секунду может писать одна строка кода (ниже ERROR), 0 - без ограничения
+LOG_RATE = int(os.environ.get('LOG_RATE', '10'))
+
 # Логируем для отладки
-logger.info(f"Loaded admin IDs: {ADMIN_IDS}")
\ No newline at end of file
+logger.info(f"Loaded {len(ADMIN_IDS)} admin IDs")
\ No newline at end of file
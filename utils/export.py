@@ -0,0 +1,74 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from db.database import EXPORT_TABLES
+
+FORMATS = ("csv", "jsonl")
+
+
+class GzipTableWriter:
+    """
+    Writes rows of one table to a gzip-compressed CSV or JSON Lines file.
+    Methods do blocking file I/O and are meant to run in a thread.
+    """
+    def __init__(self, path, columns, fmt="csv"):
+        self.columns = columns
+        self.fmt = fmt
+        # Level 5 is several times faster than the default 9 and almost as small
+        self._file = gzip.open(path, "wt", compresslevel=5, encoding="utf-8", newline="")
+        if fmt == "csv":
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(columns)
+
+    def write(self, rows):
+        if self.fmt == "csv":
+            self._csv.writerows(rows)
+        else:
+            for row in rows:
+                self._file.write(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False, default=str))
+                self._file.write("\n")
+
+    def close(self):
+        self._file.close()
+
+
+async def export_table(db, name, fmt="csv", chunk_size=5000):
+    """
+    Export a table to a temporary gzip file, one chunk in memory at a time.
+    Reads go through the database executor, compression and writes
+    run in a separate thread, so the event loop is never blocked.
+    :param db: AsyncDatabase instance
+    :param name: key of EXPORT_TABLES
+    :return: (path of the file, number of rows), the caller deletes the file
+    """
+    _, key_size, columns = EXPORT_TABLES[name]
+    fd, path = tempfile.mkstemp(prefix=f"{name}_", suffix=f".{fmt}.gz")
+    os.close(fd)
+    rows_written = 0
+    try:
+        writer = await asyncio.to_thread(GzipTableWriter, path, columns, fmt)
+        try:
+            after = None
+            while True:
+                rows = await db.get_export_chunk(name, after, chunk_size)
+                if not rows:
+                    break
+                await asyncio.to_thread(writer.write, rows)
+                rows_written += len(rows)
+                after = rows[-1][:key_size]
+        finally:
+            await asyncio.to_thread(writer.close)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, rows_written
+
+
+def export_filename(name, fmt):
+    """Name of the exported file shown in Telegram"""
+    return f"{name}_{datetime.now():%Y-%m-%d}.{fmt}.gz"
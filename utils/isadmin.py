@@ -10,14 +10,20 @@ from utils.config import ADMIN_IDS
 class IsAdmin(BaseFilter):
     """
     Filter that checks if the user is an admin
+    of the bot that received the message
     """
-    async def __call__(self, message: Message) -> bool:
+    async def __call__(self, message: Message, admin_ids=None) -> bool:
+        """
+        :param admin_ids: admins of the bot, set by utils.tenants.TenantMiddleware
+        """
         user_id = message.from_user.id
-        is_admin = str(user_id) in ADMIN_IDS
+        is_admin = str(user_id) in (ADMIN_IDS if admin_ids is None else admin_ids)
         
+        # Runs for every message that reaches the admin router, keep it cheap:
+        # DEBUG with lazy arguments isn't even formatted unless enabled
         if is_admin:
-            logger.info(f"User {user_id} is recognized as admin")
+            logger.debug("User {} is recognized as admin", user_id)
         else:
-            logger.info(f"User {user_id} is not an admin. Available admin IDs: {ADMIN_IDS}")
+            logger.debug("User {} is not an admin", user_id)
         
         return is_admin
@@ -0,0 +1,111 @@
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from loguru import logger
+
+from utils.config import LOG_LEVEL, LOG_FILE, LOG_ROTATION, LOG_RETENTION, LOG_RATE
+from utils.metrics import handler_name
+
+CONSOLE_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "{extra[update_id]} {extra[handler]} | <cyan>{name}:{line}</cyan> - <level>{message}</level>"
+)
+
+
+class LogLimiter:
+    """
+    Loguru patcher that thins out noisy records before they reach the sinks.
+
+    Records bound with `sample` (logger.bind(sample=0.01)) are kept with that
+    probability, and every call site may emit at most `rate` records per second
+    with bursts of `rate`. Records at `min_level` and above are never dropped.
+    Dropped records are marked in extra and skipped by `filter`, the next kept
+    record of the call site carries the number of records dropped before it.
+    """
+    def __init__(self, rate=10, min_level="ERROR"):
+        self.rate = rate
+        self.min_level = logger.level(min_level).no
+        self.dropped = 0
+        # (module, line) -> (tokens, updated, dropped since last kept)
+        self._sites = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        extra = record["extra"]
+        extra.setdefault("update_id", "-")
+        extra.setdefault("handler", "-")
+        sample = extra.pop("sample", None)
+        if record["level"].no >= self.min_level:
+            return
+        if sample is not None and random.random() >= sample:
+            extra["_drop"] = True
+            return
+        if not self.rate:
+            return
+
+        key = (record["name"], record["line"])
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, dropped = self._sites.get(key, (self.rate, now, 0))
+            tokens = min(self.rate, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._sites[key] = (tokens, now, dropped + 1)
+                self.dropped += 1
+                extra["_drop"] = True
+                return
+            self._sites[key] = (tokens - 1, now, 0)
+        if dropped:
+            extra["suppressed"] = dropped
+
+    @staticmethod
+    def filter(record):
+        return "_drop" not in record["extra"]
+
+
+limiter = LogLimiter(LOG_RATE)
+
+
+def setup_logging(name=None, level=LOG_LEVEL, path=LOG_FILE):
+    """
+    Replace the default loguru sink with non-blocking ones: colored console
+    output and a JSON file with size-based rotation. Both are enqueued, records
+    are written by a background thread and never block the event loop.
+    :param name: process name, added to the file name so processes don't share a file
+    """
+    if name:
+        root, ext = os.path.splitext(path)
+        path = f"{root}.{name}{ext}"
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    logger.remove()
+    logger.configure(patcher=limiter)
+    logger.add(sys.stderr, level=level, format=CONSOLE_FORMAT, filter=limiter.filter, enqueue=True)
+    logger.add(
+        path, level=level, filter=limiter.filter, enqueue=True, serialize=True,
+        rotation=LOG_ROTATION, retention=LOG_RETENTION, compression="gz",
+    )
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """
+    Tags log records with the update id when used as an outer update
+    middleware, and with the handler name when used as an inner one
+    """
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if "handler" in data:
+            context = {"handler": handler_name(data["handler"])}
+        else:
+            context = {"update_id": getattr(event, "update_id", "-")}
+        with logger.contextualize(**context):
+            return await handler(event, data)
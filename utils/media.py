@@ -0,0 +1,87 @@
+import asyncio
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, PhotoSize
+from loguru import logger
+
+# Parts of Telegram error messages about a file_id that can't be used,
+# other bad requests (caption, chat) would fail the same way after an upload
+FILE_ID_ERRORS = ("file identifier", "remote file", "file_reference", "file reference")
+
+
+def is_file_id_error(error: TelegramBadRequest):
+    """True if Telegram rejected the file_id of a request rather than something else in it"""
+    message = error.message.lower()
+    return any(part in message for part in FILE_ID_ERRORS)
+
+
+class MediaRegistry:
+    """
+    Named images stored as local files in media_dir.
+    Each file is uploaded once per bot, the returned file_id is kept in
+    the settings table under "media:<name>:<bot id>" and reused afterwards.
+    """
+    def __init__(self, db, media_dir='data/media'):
+        self._db = db
+        self.media_dir = media_dir
+        self._upload_locks = {}
+
+    def path(self, name):
+        """Local file of a named image"""
+        return os.path.join(self.media_dir, f"{name}.jpg")
+
+    @staticmethod
+    def _prefix(name):
+        return f"media:{name}:"
+
+    def _key(self, name, bot: Bot):
+        # file_id is only valid for the bot that received it
+        return f"{self._prefix(name)}{bot.id}"
+
+    async def send_photo(self, bot: Bot, chat_id, name, default=None, **kwargs):
+        """
+        Send a named image by cached file_id, uploading the local file if needed
+        :param default: file_id used when there is neither a cached id nor a local file
+        :return: sent Message
+        """
+        file_id = self._db.settings.get(self._key(name, bot))
+        if file_id:
+            try:
+                return await bot.send_photo(chat_id, file_id, **kwargs)
+            except TelegramBadRequest as e:
+                if not is_file_id_error(e) or not os.path.exists(self.path(name)):
+                    raise
+                # Cached id became unusable, upload the local copy again
+                logger.warning(f"Cached file_id for {name} rejected: {e}")
+                await self._db.delete_setting(self._key(name, bot))
+
+        if not os.path.exists(self.path(name)):
+            return await bot.send_photo(chat_id, default, **kwargs)
+
+        lock = self._upload_locks.setdefault(self._key(name, bot), asyncio.Lock())
+        async with lock:
+            # Another request may have uploaded it while we were waiting
+            file_id = self._db.settings.get(self._key(name, bot))
+            if file_id:
+                return await bot.send_photo(chat_id, file_id, **kwargs)
+
+            message = await bot.send_photo(chat_id, FSInputFile(self.path(name)), **kwargs)
+            await self._db.update_setting(self._key(name, bot), message.photo[-1].file_id)
+            logger.info(f"Uploaded {name} for bot {bot.id}")
+            return message
+
+    async def replace(self, bot: Bot, name, photo: PhotoSize):
+        """
+        Replace a named image with a photo received by the bot.
+        The file is saved locally so other bots and new tokens can upload it too.
+        """
+        os.makedirs(self.media_dir, exist_ok=True)
+        tmp_path = self.path(name) + ".tmp"
+        await bot.download(photo, destination=tmp_path)
+        os.replace(tmp_path, self.path(name))
+
+        # Forget ids of the old picture for every bot, then remember ours
+        await self._db.delete_settings(self._prefix(name))
+        await self._db.update_setting(self._key(name, bot), photo.file_id)
@@ -0,0 +1,190 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType, Response
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+# Upper bounds in seconds, from 0.5 ms to 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets, safe to update from several threads
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # The last slot counts values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                if index == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """
+    Registry of histograms and gauges, rendered in the Prometheus text format
+    """
+    def __init__(self):
+        self._histograms = {}
+        self._gauges = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        """Set the HELP line of a metric"""
+        self._help[name] = help_text
+
+    def histogram(self, name, label, value):
+        """Get or create the histogram `name{label="value"}`"""
+        key = (name, label, value)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name, label, value, seconds):
+        self.histogram(name, label, value).observe(seconds)
+
+    def gauge(self, name, func, help_text="", kind="gauge"):
+        """
+        Register a gauge whose value is read from func() on every render.
+        Gauges registered under one name, e.g. by the databases of several bots, are summed
+        """
+        with self._lock:
+            funcs = self._gauges.get(name, ((), kind))[0]
+            self._gauges[name] = (funcs + (func,), kind)
+        self._help[name] = help_text
+
+    def counter(self, name, func, help_text=""):
+        """Register a counter whose value is read from func() on every render"""
+        self.gauge(name, func, help_text, kind="counter")
+
+    def histograms(self, name):
+        """Get {label value: histogram} of a metric"""
+        return {value: h for (n, _, value), h in list(self._histograms.items()) if n == name}
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        families = {}
+        for (name, label, value), histogram in sorted(self._histograms.items()):
+            families.setdefault(name, []).append((label, value, histogram))
+        for name, items in families.items():
+            lines.append(f"# HELP {name} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {name} histogram")
+            for label, value, histogram in items:
+                cumulative = 0
+                for bucket, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label}="{value}",le="{bucket}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label}="{value}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{name}_sum{{{label}="{value}"}} {histogram.sum}')
+                lines.append(f'{name}_count{{{label}="{value}"}} {histogram.count}')
+        for name, (funcs, kind) in sorted(self._gauges.items()):
+            lines.append(f"# HELP {name} {self._help.get(name, '')}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.append(f"{name} {sum(func() for func in funcs)}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry
+metrics = Metrics()
+
+HANDLER_SECONDS = "bot_handler_seconds"
+DB_SECONDS = "bot_db_query_seconds"
+API_SECONDS = "bot_api_request_seconds"
+metrics.describe(HANDLER_SECONDS, "Time spent in update handlers")
+metrics.describe(DB_SECONDS, "Time spent in Database methods on the executor")
+metrics.describe(API_SECONDS, "Duration of Bot API requests")
+
+
+def handler_name(handler):
+    """Readable name of a handler callback, unwrapping functools.partial"""
+    callback = getattr(handler, "callback", handler)
+    callback = getattr(callback, "func", callback)
+    return getattr(callback, "__name__", repr(callback))
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner middleware that records how long each handler takes
+    """
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            metrics.observe(
+                HANDLER_SECONDS, "handler", handler_name(data.get("handler")), time.perf_counter() - start
+            )
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """
+    Session middleware that records the duration of every Bot API request
+    """
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            metrics.observe(API_SECONDS, "method", type(method).__name__, time.perf_counter() - start)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """aiohttp handler serving the metrics in the Prometheus format"""
+    return web.Response(text=metrics.render(), content_type="text/plain")
+
+
+async def run_metrics_server(host, port, path="/metrics"):
+    """Serve the metrics endpoint until cancelled"""
+    app = web.Application()
+    app.router.add_get(path, metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
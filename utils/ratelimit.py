@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Async token bucket: allows `rate` acquisitions per second
+    with bursts of up to `capacity`
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Wait until a token is available and take it"""
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            self._refill()
+            # A loop, pause() may push the next token further while we sleep
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def pause(self, seconds):
+        """Make the next acquisition wait at least `seconds`, e.g. after hitting flood control"""
+        self._refill()
+        self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+
+class ChatPacer:
+    """
+    Keeps at least `interval` seconds between two sends to the same chat
+    """
+    def __init__(self, interval=1.0, max_chats=10000):
+        self.interval = interval
+        self.max_chats = max_chats
+        self._next_send = {}
+
+    async def wait(self, chat_id):
+        """Wait until the chat may receive the next message"""
+        now = time.monotonic()
+        next_send = self._next_send.get(chat_id, now)
+        if next_send > now:
+            await asyncio.sleep(next_send - now)
+            now = next_send
+        self._next_send[chat_id] = now + self.interval
+
+        if len(self._next_send) > self.max_chats:
+            # Chats whose pause is over don't need to be remembered
+            self._next_send = {k: v for k, v in self._next_send.items() if v > now}
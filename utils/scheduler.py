@@ -0,0 +1,126 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+from loguru import logger
+
+from utils.config import ADMIN_IDS
+from utils.metrics import metrics
+
+# Under overload a drop happens for every update, log only about one in a hundred
+sampled_logger = logger.bind(sample=0.01)
+
+# Admin updates and answers to a bot question (FSM state set) go first
+PRIORITY_HIGH = 0
+PRIORITY_USER = 1
+PRIORITY_NAMES = ("priority", "user")
+
+
+class UpdateScheduler(BaseMiddleware):
+    """
+    Outer update middleware that handles at most `workers` updates at a time.
+
+    Updates over the limit wait in a bounded queue per priority. A freed slot
+    goes to the oldest high priority update first, user updates wait until
+    none is left. When a queue is full, new updates of that priority are shed:
+    they are dropped before any handler or database work.
+
+    Must be registered after TenantMiddleware, it reads admin_ids and the FSM
+    state set by the middlewares before it. The handler keeps running in the
+    task of its update, so log context set by earlier middlewares stays.
+    """
+    def __init__(self, workers=32, max_queue=1000):
+        """
+        :param workers: updates handled at the same time
+        :param max_queue: updates of one priority that may wait for a slot
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.running = 0
+        self.shed = [0, 0]
+        self._queues = (deque(), deque())
+        metrics.gauge("bot_scheduler_running", lambda: self.running, "Updates being handled")
+        for priority, name in enumerate(PRIORITY_NAMES):
+            metrics.gauge(
+                f"bot_scheduler_queue_{name}", lambda priority=priority: len(self._queues[priority]),
+                f"Updates with {name} priority waiting for a slot"
+            )
+            metrics.counter(
+                f"bot_scheduler_shed_{name}_total", lambda priority=priority: self.shed[priority],
+                f"Updates with {name} priority dropped because the queue was full"
+            )
+
+    def queued(self, priority=None):
+        """Number of updates waiting for a slot, of one priority or all"""
+        if priority is None:
+            return sum(len(queue) for queue in self._queues)
+        return len(self._queues[priority])
+
+    @staticmethod
+    def priority(data):
+        """Priority of an update from the middleware data"""
+        if data.get("raw_state") is not None:
+            return PRIORITY_HIGH
+        user: User = data.get("event_from_user")
+        if user is not None and str(user.id) in data.get("admin_ids", ADMIN_IDS):
+            return PRIORITY_HIGH
+        return PRIORITY_USER
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        priority = self.priority(data)
+        if not await self._acquire(priority):
+            self.shed[priority] += 1
+            sampled_logger.warning(
+                "Scheduler is saturated, dropped update {} ({} priority)",
+                getattr(event, "update_id", "-"), PRIORITY_NAMES[priority]
+            )
+            return None
+        data["scheduler"] = self
+        try:
+            return await handler(event, data)
+        finally:
+            self._release()
+
+    async def _acquire(self, priority):
+        """
+        Wait for a free slot
+        :return: False if the queue of this priority is full
+        """
+        if self.running < self.workers and not self.queued():
+            self.running += 1
+            return True
+
+        queue = self._queues[priority]
+        if len(queue) >= self.max_queue:
+            return False
+        slot = asyncio.get_running_loop().create_future()
+        queue.append(slot)
+        try:
+            # _release hands its slot over, running is already counted for us
+            await slot
+        except asyncio.CancelledError:
+            if slot.done() and not slot.cancelled():
+                self._release()
+            else:
+                try:
+                    queue.remove(slot)
+                except ValueError:
+                    pass
+            raise
+        return True
+
+    def _release(self):
+        for queue in self._queues:
+            while queue:
+                slot = queue.popleft()
+                if not slot.done():
+                    slot.set_result(None)
+                    return
+        self.running -= 1
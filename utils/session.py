@@ -0,0 +1,96 @@
+import asyncio
+import random
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from loguru import logger
+
+from utils.metrics import metrics
+from utils.ratelimit import TokenBucket
+
+
+class BotApiSession(AiohttpSession):
+    """
+    aiohttp session for the Bot API with a bounded connection pool,
+    an outbound rate limit per bot and retries on flood control.
+
+    Every request of a bot takes a token from the bot's bucket first, so
+    handlers, broadcasts and everything else share one budget. A 429 pauses
+    the bucket for retry_after, which holds back the other requests of the
+    bot too, and the request is retried after retry_after plus jitter.
+    """
+    def __init__(self, pool_size=100, pool_size_per_host=0, keepalive_timeout=30,
+                 rate=30, burst=None, max_retries=3, max_retry_after=60, jitter=0.25, **kwargs):
+        """
+        :param pool_size: max open connections, 0 - unlimited
+        :param pool_size_per_host: max open connections to one host, 0 - unlimited
+        :param keepalive_timeout: seconds an idle connection is kept open for reuse
+        :param rate: requests per second per bot, 0 - unlimited
+        :param burst: requests per bot that may go at once, `rate` by default
+        :param max_retries: retries of a request answered with 429
+        :param max_retry_after: longer flood waits are not retried, the error is raised
+        :param jitter: extra wait before a retry, as a fraction of retry_after, so requests
+                       paused together don't all come back at the same moment
+        """
+        super().__init__(limit=pool_size, **kwargs)
+        self._connector_init.update(limit_per_host=pool_size_per_host, keepalive_timeout=keepalive_timeout)
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.jitter = jitter
+        # bot id -> TokenBucket
+        self._governors = {}
+        self.waiting = 0
+        self.in_flight = 0
+        self.retries = 0
+        metrics.gauge("bot_api_queue_depth", lambda: self.waiting, "Bot API requests waiting for the rate limit")
+        metrics.gauge("bot_api_in_flight", lambda: self.in_flight, "Bot API requests being sent")
+        metrics.counter("bot_api_retries_total", lambda: self.retries, "Bot API requests retried after flood control")
+
+    def governor(self, bot: Bot):
+        """Rate limit of a bot, None if requests are not limited"""
+        if not self.rate:
+            return None
+        governor = self._governors.get(bot.id)
+        if governor is None:
+            governor = self._governors[bot.id] = TokenBucket(self.rate, self.burst)
+        return governor
+
+    async def make_request(
+        self,
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+        timeout=None,
+    ) -> TelegramType:
+        governor = self.governor(bot)
+        attempt = 0
+        while True:
+            if governor is not None:
+                self.waiting += 1
+                try:
+                    await governor.acquire()
+                finally:
+                    self.waiting -= 1
+
+            self.in_flight += 1
+            try:
+                return await super().make_request(bot, method, timeout)
+            except TelegramRetryAfter as e:
+                attempt += 1
+                if attempt > self.max_retries or e.retry_after > self.max_retry_after:
+                    raise
+                delay = e.retry_after * (1 + random.uniform(0, self.jitter))
+                if governor is not None:
+                    governor.pause(e.retry_after)
+            finally:
+                self.in_flight -= 1
+
+            self.retries += 1
+            logger.warning(
+                "Flood control on {}, retry {} in {:.1f}s", method.__api_method__, attempt, delay
+            )
+            await asyncio.sleep(delay)
@@ -12,3 +12,5 @@ class AdminSettings(StatesGroup):
     WAITING_FOR_WELCOME_TEXT = State()
     WAITING_FOR_WELCOME_LINK = State()
     WAITING_FOR_LINK_TEXT = State()
+    WAITING_FOR_PHOTO = State()
+    WAITING_FOR_BROADCAST = State()
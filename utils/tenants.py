@@ -0,0 +1,128 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import TelegramObject
+from loguru import logger
+
+from utils.config import TOKEN, ADMIN_IDS, MEDIA_DIR
+from utils.media import MediaRegistry
+from utils.welcome import WelcomeResponseCache
+
+
+@dataclass(frozen=True)
+class BotConfig:
+    """
+    One bot served by the process
+    """
+    name: str
+    token: str
+    admin_ids: frozenset
+    db_file: str = "data/db.sqlite"
+    media_dir: str = "data/media"
+
+
+def parse_admin_ids(admin_ids):
+    """Admin ids as a set of strings, the way IsAdmin compares them"""
+    return frozenset(str(admin_id).strip() for admin_id in admin_ids if str(admin_id).strip())
+
+
+def load_bot_configs(path=None):
+    """
+    Read the bots to serve from a JSON file:
+    [{"name": "congress", "token": "123:ABC", "admin_ids": [1, 2], "db": "data/congress.sqlite"}, ...]
+    "db" and "media_dir" are optional, by default every bot gets its own file and folder by name.
+    :param path: JSON file, without it the only bot is the one from BOT_TOKEN and ADMIN_IDS
+    :return: list of BotConfig
+    """
+    if not path:
+        return [BotConfig("default", TOKEN, parse_admin_ids(ADMIN_IDS), media_dir=MEDIA_DIR)]
+
+    with open(path, encoding="utf-8") as file:
+        entries = json.load(file)
+    configs = []
+    for entry in entries:
+        name = entry["name"]
+        configs.append(BotConfig(
+            name=name,
+            token=entry["token"],
+            admin_ids=parse_admin_ids(entry.get("admin_ids", ())),
+            db_file=entry.get("db", os.path.join("data", "bots", f"{name}.sqlite")),
+            media_dir=entry.get("media_dir", os.path.join(MEDIA_DIR, name)),
+        ))
+    if len({config.name for config in configs}) != len(configs):
+        raise ValueError(f"Bot names in {path} must be unique")
+    return configs
+
+
+class Tenant:
+    """
+    Everything that belongs to one bot: its database with the settings,
+    the welcome response, pictures, broadcasts and admins.
+    Handlers get these from TenantMiddleware by parameter name.
+    """
+    def __init__(self, config: BotConfig, bot: Bot, db, broadcaster, retention=None):
+        """
+        :param db: AsyncDatabase instance
+        :param broadcaster: Broadcaster instance
+        :param retention: RetentionJob instance, if this process archives old clicks
+        """
+        self.config = config
+        self.bot = bot
+        self.db = db
+        self.broadcaster = broadcaster
+        self.retention = retention
+        # Welcome response and picture are shared by /start and /view_welcome
+        self.welcome = WelcomeResponseCache(db)
+        self.media = MediaRegistry(db, config.media_dir)
+        self.data = {
+            "tenant": self,
+            "db": db,
+            "welcome": self.welcome,
+            "media": self.media,
+            "broadcaster": broadcaster,
+            "admin_ids": config.admin_ids,
+        }
+
+    @property
+    def name(self):
+        return self.config.name
+
+    def start(self):
+        """Start background tasks, must be called from a running loop"""
+        self.db.start()
+        if self.retention:
+            self.retention.start()
+
+    async def close(self):
+        """Pause broadcasts, stop background jobs, write out buffered inserts and close the database"""
+        await self.broadcaster.close()
+        if self.retention:
+            await self.retention.close()
+        await self.db.drain()
+        await self.db.close()
+
+
+class TenantMiddleware(BaseMiddleware):
+    """
+    Outer update middleware: passes the tenant of the bot that received
+    the update to filters and handlers, and tags log records with its name
+    """
+    def __init__(self, tenants):
+        self.tenants = {tenant.bot.id: tenant for tenant in tenants}
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        tenant = self.tenants.get(data["bot"].id)
+        if tenant is None:
+            logger.warning("Update for unknown bot {}", data["bot"].id)
+            return None
+        data.update(tenant.data)
+        with logger.contextualize(bot=tenant.name):
+            return await handler(event, data)
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+from loguru import logger
+
+# A flood produces a drop per message, log only about one in a hundred
+sampled_logger = logger.bind(sample=0.01)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Per-user token bucket: each user may send `burst` updates at once and
+    then `rate` updates per second, everything above is dropped before the handler runs.
+    A user talking to several bots of the process has a bucket for each of them.
+
+    Buckets live in an LRU ordered dict of (bot id, user_id) -> (tokens, updated).
+    A bucket idle long enough to refill is the same as a new one, so it is
+    evicted, and at most `max_users` buckets are kept at any time.
+    """
+    def __init__(self, rate=1.0, burst=3, max_users=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        # Time after which an unused bucket is full again
+        self.idle_ttl = burst / rate
+        self._buckets = OrderedDict()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key, now=None):
+        """
+        Take a token from a bucket
+        :param key: (bot id, user_id)
+        :return: False if the user is over the limit
+        """
+        now = time.monotonic() if now is None else now
+        tokens, updated = self._buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        # Re-inserted at the end, so the dict stays ordered by last activity
+        self._buckets[key] = (tokens, now)
+        self._evict(now)
+        return allowed
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while buckets:
+            key, (_, updated) = next(iter(buckets.items()))
+            if len(buckets) <= self.max_users and now - updated < self.idle_ttl:
+                break
+            del buckets[key]
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: User = data.get("event_from_user")
+        if user is not None and not self.allow((data["bot"].id, user.id)):
+            self.dropped += 1
+            sampled_logger.debug("Dropped update from user {}, {} dropped in total", user.id, self.dropped)
+            return None
+        return await handler(event, data)
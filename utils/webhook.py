@@ -0,0 +1,101 @@
+import asyncio
+import hmac
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+from loguru import logger
+from pydantic import ValidationError
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookHandler:
+    """
+    aiohttp handler for Telegram webhook requests.
+    Checks the secret token, answers 200 right away and processes
+    the update in a background task.
+    """
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token=None, feed=None):
+        """
+        :param secret_token: expected value of the X-Telegram-Bot-Api-Secret-Token header
+        :param feed: coroutine function taking (bot, update), Dispatcher.feed_update by default
+        """
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret_token = secret_token
+        self._feed = feed or dispatcher.feed_update
+        # Keep references, otherwise running tasks may be garbage collected
+        self._tasks = set()
+
+    async def __call__(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except (ValueError, ValidationError):
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self._feed(self.bot, update)
+        except Exception:
+            logger.exception(f"Failed to process update {update.update_id}")
+
+    async def close(self):
+        """Wait for updates that are still being processed"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def webhook_path(path, bot: Bot, bots):
+    """Path of a bot's webhook, with several bots each one gets path/<bot id>"""
+    return path if len(bots) == 1 else f"{path.rstrip('/')}/{bot.id}"
+
+
+async def run_webhook(dispatcher: Dispatcher, bots, host, port, path,
+                      url=None, secret_token=None, feed=None, app=None):
+    """
+    Serve the webhooks of all bots on one server until cancelled
+    :param bots: list of Bot instances
+    :param url: public base URL, the webhooks are registered in Telegram only if it is set
+    :param app: existing aiohttp application to add the routes to
+    """
+    app = app or web.Application()
+    handlers = []
+    for bot in bots:
+        handler = WebhookHandler(dispatcher, bot, secret_token=secret_token, feed=feed)
+        app.router.add_post(webhook_path(path, bot, bots), handler)
+        handlers.append(handler)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Webhook server listening on {host}:{port}{path}")
+
+    if url:
+        for bot in bots:
+            await bot.set_webhook(
+                url.rstrip("/") + webhook_path(path, bot, bots),
+                secret_token=secret_token or None,
+                allowed_updates=dispatcher.resolve_used_update_types(),
+            )
+
+    # Once for all bots, the same as Dispatcher.start_polling does
+    await dispatcher.emit_startup(bot=bots[-1], bots=bots)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        for handler in handlers:
+            await handler.close()
+        await dispatcher.emit_shutdown(bot=bots[-1], bots=bots)
@@ -0,0 +1,57 @@
+from dataclasses import dataclass, field
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+
+@dataclass(frozen=True)
+class WelcomeResponse:
+    """
+    Ready-to-send welcome message, identical for every user
+    until the settings change. The keyboard model is built once and
+    reused, aiogram still serializes it to JSON for every request.
+    """
+    version: int
+    caption: str
+    link: str
+    link_text: str
+    reply_markup: InlineKeyboardMarkup
+    # caption and reply_markup as keyword arguments for send_photo / answer
+    fields: dict = field(default_factory=dict)
+
+
+class WelcomeResponseCache:
+    """
+    Builds the welcome response once per settings version
+    """
+    def __init__(self, db):
+        self._db = db
+        self._response = None
+
+    async def get(self) -> WelcomeResponse:
+        """Get the welcome response for the current settings version"""
+        version = self._db.settings_version
+        response = self._response
+        if response is None or response.version != version:
+            response = await self._build(version)
+            self._response = response
+        return response
+
+    async def _build(self, version) -> WelcomeResponse:
+        caption = await self._db.get_welcome_message()
+        link = await self._db.get_welcome_link()
+        link_text = await self._db.get_welcome_link_text()
+
+        # Create inline keyboard with link button
+        keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text=link_text, url=link)]
+            ]
+        )
+        return WelcomeResponse(
+            version=version,
+            caption=caption,
+            link=link,
+            link_text=link_text,
+            reply_markup=keyboard,
+            fields={"caption": caption, "reply_markup": keyboard},
+        )
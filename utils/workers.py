@@ -0,0 +1,118 @@
+import asyncio
+import multiprocessing
+import queue
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware
+from aiogram.types import TelegramObject, Update
+from loguru import logger
+
+# Put into a worker's queue to make it finish
+STOP = None
+
+
+def worker_index(chat_id, workers):
+    """Index of the worker that owns a chat"""
+    return (chat_id or 0) % workers
+
+
+class WorkerPool:
+    """
+    Worker processes fed by the ingress process.
+
+    Every update is sent as JSON to the worker that owns its chat, so one
+    chat is always handled by the same process: its FSM state, throttling
+    bucket and admin broadcasts stay in one place and updates of a chat
+    keep their order.
+    """
+    def __init__(self, workers, target):
+        """
+        :param workers: number of worker processes
+        :param target: picklable function taking (index, workers, queue), run in each process
+        """
+        self.workers = workers
+        self.forwarded = 0
+        # spawn instead of fork: children must not inherit the running event loop
+        context = multiprocessing.get_context("spawn")
+        self.queues = [context.Queue() for _ in range(workers)]
+        self.processes = [
+            context.Process(target=target, args=(index, workers, self.queues[index]), name=f"worker-{index}")
+            for index in range(workers)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        logger.info(f"Started {self.workers} worker processes")
+
+    async def feed(self, bot: Bot, update: Update):
+        """Send an update to its worker, same signature as Dispatcher.feed_update"""
+        context = UserContextMiddleware.resolve_event_context(update)
+        chat_id = context.chat.id if context.chat else context.user.id if context.user else update.update_id
+        self.queues[worker_index(chat_id, self.workers)].put(update.model_dump_json(exclude_unset=True))
+        self.forwarded += 1
+
+    async def close(self, timeout=30):
+        """Let workers finish queued updates and stop them"""
+        for worker_queue in self.queues:
+            worker_queue.put(STOP)
+        for process in self.processes:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} didn't stop in {timeout}s, terminating")
+                process.terminate()
+
+
+class ForwardToWorkersMiddleware(BaseMiddleware):
+    """
+    Outer update middleware of the ingress dispatcher: hands updates
+    to the worker pool instead of handling them
+    """
+    def __init__(self, pool: WorkerPool):
+        self.pool = pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        await self.pool.feed(data["bot"], event)
+        return None
+
+
+async def consume_updates(dp: Dispatcher, bot: Bot, updates_queue, concurrency=100, poll_interval=1.0):
+    """
+    Handle updates from the ingress process until STOP arrives or the ingress dies
+    :param concurrency: updates handled at the same time
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+
+    async def handle(raw):
+        try:
+            update = Update.model_validate_json(raw, context={"bot": bot})
+            await dp.feed_update(bot, update)
+        except Exception:
+            logger.exception("Failed to process update")
+        finally:
+            semaphore.release()
+
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            raw = await asyncio.to_thread(updates_queue.get, timeout=poll_interval)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                logger.warning("Ingress process is gone, stopping")
+                break
+            continue
+        if raw is STOP:
+            break
+        await semaphore.acquire()
+        task = asyncio.create_task(handle(raw))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*tasks, return_exceptions=True)